@@ -1,83 +1,207 @@
 #!/usr/bin/env python3
-from time import sleep, time
+import logging
+import time
 
+import logs
 from arbitrator import Arbitrator
 from sensob import LineSensob, ProximitySensob, ColorSensob
 from behaviour import CrashPreventionBehaviour, GoalBehaviour, LineBehaviour, ExploreBehaviour
-from motob import Motob
-from zumo_button import ZumoButton
+from scheduler import Scheduler
+
+log = logging.getLogger(__name__)
 
 class BBCON:
-    def __init__(self, arbitrator):
+    # With concurrent=True every sensob is read by its own background thread, and a tick only takes the
+    # latest reading of each instead of waiting for the sensors one after another.
+    def __init__(self, arbitrator, concurrent=False):
         self.behaviours = []
-        self.sensobs = []
+        self.sensobs = {}  # Sensob -> number of subscriptions; only these sensobs are polled
+        self.subscriptions = {}  # Behaviour -> the sensobs it is subscribed to
+        self.active = []  # The active behaviours, in the order they were added
         self.motobs = []
         self.arbitrator = arbitrator
+        self.concurrent = concurrent
+        self.instrumentation = None
+        self.tick = 0
+        self.observers = []  # Called with the controller at the end of every tick, before the sensobs are invalidated
+
+    # Time the calls of this controller, its arbitrator, sensobs and behaviours (including ones added later)
+    # with an Instrumentation.  None removes the timing again.
+    def instrument(self, instrumentation):
+        if self.instrumentation is not None:
+            self.instrumentation.unwatch_all()
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.watch(self, 'controller')
+            instrumentation.watch(self.arbitrator, 'arbitrator')
+            for sensob in self.sensobs:
+                instrumentation.watch(sensob, 'sensob')
+            for behaviour in self.behaviours:
+                instrumentation.watch(behaviour, 'behaviour')
 
     def add_behaviour(self, behaviour):
         behaviour.controller = self
-        for sensob in behaviour.sensobs:
-            self.add_sensob(sensob)
+        self.subscriptions[behaviour] = set()
+        self._subscribe(behaviour)
         self.behaviours.append(behaviour)
+        if self.instrumentation is not None:
+            self.instrumentation.watch(behaviour, 'behaviour')
+
+    # Subscribe a behaviour to the sensobs in its sensobs list it is not yet subscribed to
+    def _subscribe(self, behaviour, update=False):
+        subscribed = self.subscriptions[behaviour]
+        for sensob in behaviour.sensobs:
+            if sensob not in subscribed:
+                subscribed.add(sensob)
+                self.add_sensob(sensob, update)
 
+    # Each call counts as one subscription; the sensob is polled until remove_sensob has been called as often
     def add_sensob(self, sensob, update=False):
-        if sensob not in self.sensobs:
-            self.sensobs.append(sensob)
+        count = self.sensobs.get(sensob, 0)
+        self.sensobs[sensob] = count + 1
+        if count == 0:
+            if self.instrumentation is not None:
+                self.instrumentation.watch(sensob, 'sensob')
+            if self.concurrent:
+                sensob.start_sampling()
             if update:
                 sensob.update()
 
+    def remove_sensob(self, sensob):
+        count = self.sensobs.get(sensob, 0)
+        if count > 1:
+            self.sensobs[sensob] = count - 1
+        elif count == 1:
+            del self.sensobs[sensob]
+            sensob.stop_sampling()
+            sensob.reset()  # No longer invalidated every tick, so its reading would be stale when next polled
+
     def add_motob(self, motob):
         if motob not in self.motobs:
             self.motobs.append(motob)
 
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
     def run_one_timestep(self):
+        self.tick += 1
+        self.update_sensobs()
+        self.update_activity()
+        active = self.active_behaviours()
+        self.update_behaviours(active)
+        self.arbitrator.choose_action(active)
+        if self.arbitrator.halt:
+            for motob in self.motobs:
+                motob.update(('s', None))
+            self.notify_observers()
+            return True
+        self.update_motobs()
+        self.notify_observers()
+        self.invalidate_sensobs()
+
+    # The stages of a timestep, in order
+
+    def update_sensobs(self):
         for sensob in self.sensobs:
             sensob.update()
+
+    def update_activity(self):
         for b in self.behaviours:
             b.update_activity()
-        active = self._active_behaviours()
+
+    def update_behaviours(self, active):
         for b in active:
             b.update()
-        self.arbitrator.choose_action(active)
-        if self.arbitrator.halt:
-            for motob in self.motobs:
-                motob.update(('s', None))
-            return True
+
+    def update_motobs(self):
         for motob in self.motobs:
-            print("Setting motob to {}".format(self.arbitrator.recommendation))
+            log.debug("Setting motob to %s", self.arbitrator.recommendation)
             motob.update(self.arbitrator.recommendation)
-        sleep(0.5)
+
+    def notify_observers(self):
+        for observer in self.observers:
+            observer(self)
+
+    def invalidate_sensobs(self):
         for sensob in self.sensobs:
-            sensob.reset()
+            sensob.invalidate()
 
     def activate(self, behaviour):
-        for sensob in behaviour.sensobs:
-            self.add_sensob(sensob, update=True)
+        self._subscribe(behaviour, update=True)
+        self.active = [b for b in self.behaviours if b.active]
 
-    # Check if the deactivated behaviour is the last to use a sensob, and remove the sensob if it is
+    # Drop the behaviour's subscriptions to the sensobs it deactivated; a sensob stops being polled when the
+    # last behaviour using it lets go
     def deactivate(self, behaviour):
+        subscribed = self.subscriptions[behaviour]
         for sensob in behaviour.deactivated_sensobs:
-            if sensob in self.sensobs and not any(sensob in b.sensobs for b in self._active_behaviours()):
-                self.sensobs.remove(sensob)
+            if sensob in subscribed:
+                subscribed.discard(sensob)
+                self.remove_sensob(sensob)
+        self.active = [b for b in self.behaviours if b.active]
+
+    # The active behaviours, in the order they were added
+    def active_behaviours(self):
+        return self.active
+
 
-    def _active_behaviours(self):
-        return list(filter(lambda b: b.active, self.behaviours))
+# Run the setup functions (e.g. device constructors) at the same time, returning their results by name
+def setup_concurrently(**setups):
+    from concurrent.futures import ThreadPoolExecutor  # Only needed at startup
+    with ThreadPoolExecutor(max_workers=len(setups)) as pool:
+        futures = {name: pool.submit(setup) for name, setup in setups.items()}
+    return {name: future.result() for name, future in futures.items()}
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the robot")
+    parser.add_argument('--goal', action='store_true',
+                        help="also avoid obstacles and look for the green goal, with the ultrasonic sensor and camera")
+    args = parser.parse_args()
+
+    # The drivers are only imported here, and the camera only when a behaviour uses it, so a line-only run
+    # loads neither it nor PIL
+    from motob import Motob
+    from reflectance_sensors import PROFILE, ReflectanceSensors
+    from telemetry import Telemetry
+    from zumo_button import ZumoButton
+
+    logs.start(logging.INFO)
     arbitrator = Arbitrator()
-    motob = Motob()
     bbcon = BBCON(arbitrator=arbitrator)
-    bbcon.add_motob(motob)
-    print("Start calibration")
+    log.info("Start calibration")
     ZumoButton().wait_for_press()  # Start calibration after first button press
-    line_sensob = LineSensob()
-    #proximity_sensob = ProximitySensob()
-    color_sensob = ColorSensob('green')
-    #bbcon.add_behaviour(CrashPreventionBehaviour(proximity=proximity_sensob, priority=2))
-    #bbcon.add_behaviour(GoalBehaviour(proximity=proximity_sensob, color=color_sensob, priority=5))
-    bbcon.add_behaviour(LineBehaviour(line=line_sensob, priority=1))
+    pressed = time.monotonic()
+    # Calibration (skipped when a recent profile is saved), motor setup and the first camera capture overlap
+    setups = {
+        'motob': lambda: Motob(blocking=False),
+        'line': lambda: LineSensob(sensor=ReflectanceSensors(auto_calibrate=True, profile=PROFILE, refine=True)),
+    }
+    if args.goal:
+        from camera import Camera
+        setups['camera'] = lambda: Camera().warm_up()
+    devices = setup_concurrently(**setups)
+    log.info("Devices ready %.2f s after the button press", time.monotonic() - pressed)
+    bbcon.add_motob(devices['motob'])
+    if args.goal:
+        proximity_sensob = ProximitySensob()
+        color_sensob = ColorSensob('green', sensor=devices['camera'])
+        bbcon.add_behaviour(CrashPreventionBehaviour(proximity=proximity_sensob, priority=2))
+        bbcon.add_behaviour(GoalBehaviour(proximity=proximity_sensob, color=color_sensob, priority=5))
+    bbcon.add_behaviour(LineBehaviour(line=devices['line'], priority=1))
     bbcon.add_behaviour(ExploreBehaviour(priority=0.25))
-    while True:
-        if bbcon.run_one_timestep():
-            break
+
+    def report_startup(controller):
+        if controller.tick == 1:
+            log.info("First tick done %.2f s after the button press", time.monotonic() - pressed)
+    bbcon.add_observer(report_startup)
+    scheduler = Scheduler(rate=10, idle_rate=2)
+    # Watch the run live with: python3 telemetry.py
+    telemetry = Telemetry(bbcon, scheduler=scheduler)
+    scheduler.run(bbcon)
+    log.info("Scheduler summary: %s", scheduler.summary())
+    log.info("Telemetry: %d snapshots sent, %d dropped", telemetry.sent, telemetry.dropped)
@@ -1,7 +1,15 @@
 from random import choice, randint
+import logging
 import time
 
+log = logging.getLogger(__name__)
+
 class Behaviour:
+    low_cost = False  # Cheap enough that the control loop may slow down while only such behaviours are active
+    # sense_and_act depends on nothing but the sensob values, so its last result is reused while they stay the same
+    sensob_driven = False
+    settings = ()  # The attributes that tune the behaviour, as opposed to its state; recordings store them
+
     def __init__(self, priority):
         self.controller = None
         self.sensobs = []
@@ -12,6 +20,7 @@ class Behaviour:
         self.priority = priority
         self.match_degree = None
         self.weight = None
+        self.inputs = None  # The sensob versions sense_and_act last ran on
 
     # Split out of update to let activities activate in the same time unit
     def update_activity(self):
@@ -21,6 +30,11 @@ class Behaviour:
             self.consider_deactivation()
 
     def update(self):
+        if self.sensob_driven:
+            inputs = [(sensob, sensob.version) for sensob in self.sensobs]
+            if inputs == self.inputs:
+                return
+            self.inputs = inputs
         self.sense_and_act()
         self.weight = self.match_degree * self.priority
 
@@ -35,6 +49,9 @@ class Behaviour:
 
 
 class CrashPreventionBehaviour(Behaviour):
+    # Not sensob_driven: the direction it turns is drawn afresh every tick
+    settings = ('far', 'close')
+
     def __init__(self, proximity, *args, **kwargs):
         super(CrashPreventionBehaviour, self).__init__(*args, **kwargs)
         self.deactivated_sensobs.append(proximity)
@@ -53,7 +70,9 @@ class CrashPreventionBehaviour(Behaviour):
     # Assume single, forward facing sensob
     def sense_and_act(self):
         dist = self.sensobs[0].get_value()
-        if dist < self.close:
+        if dist is None:  # No echo lately, so nothing known to avoid
+            self.match_degree = 0.
+        elif dist < self.close:
             self.match_degree = 1.
         elif dist > self.far:
             self.match_degree = 0.
@@ -63,6 +82,9 @@ class CrashPreventionBehaviour(Behaviour):
 
 
 class GoalBehaviour(Behaviour):
+    sensob_driven = True
+    settings = ('trigger', 'goal', 'threshold', 'goal_threshold')
+
     def __init__(self, proximity, color, *args, **kwargs):
         super(GoalBehaviour, self).__init__(*args, **kwargs)
         self.sensobs.append(proximity)
@@ -74,15 +96,17 @@ class GoalBehaviour(Behaviour):
 
     # Keep proximity sensor active, but save time by disabling the camera
     def consider_activation(self):
-        if self.sensobs[0].get_value() < self.trigger:
-            print("Activating camera: {}".format(self.sensobs[0].get_value()))
+        dist = self.sensobs[0].get_value()
+        if dist is not None and dist < self.trigger:
+            log.info("Activating camera: %s", dist)
             self.active = True
             self.sensobs.append(self.deactivated_sensobs.pop())
             self.controller.activate(self)
 
     def consider_deactivation(self):
-        if self.sensobs[0].get_value() > self.trigger:
-            print("Deactivating camera")
+        dist = self.sensobs[0].get_value()
+        if dist is None or dist > self.trigger:
+            log.info("Deactivating camera")
             self.active = False
             self.deactivated_sensobs.append(self.sensobs.pop())
             self.controller.deactivate(self)
@@ -106,10 +130,25 @@ class GoalBehaviour(Behaviour):
 
 
 class LineBehaviour(Behaviour):
+    settings = ('loop_time', 'speed', 'pid', 'kp', 'ki', 'kd', 'slowdown', 'search_time')
+
     def __init__(self, line, *args, **kwargs):
         super(LineBehaviour, self).__init__(*args, **kwargs)
         self.deactivated_sensobs.append(line)
         self.followed_time = 0
+        self.loop_time = 15  # Seconds of following before turning off the line, to avoid circles/loops
+        self.speed = 0.3
+        # With pid, steer continuously from the line position (see follow) instead of with discrete commands
+        self.pid = False
+        self.kp = 0.4
+        self.ki = 0.
+        self.kd = 0.03
+        self.slowdown = 0.5  # Fraction of speed dropped with the line at the outermost sensor
+        self.search_time = 1.  # Seconds to keep turning towards a lost line before giving up
+        self.error = None  # Line position the last tick, -1 (leftmost sensor) to 1 (rightmost)
+        self.integral = 0.
+        self.seen = None  # When the line was last seen
+        self.last_time = None
 
     def consider_activation(self):
         self.active = True
@@ -127,28 +166,57 @@ class LineBehaviour(Behaviour):
             max_ = vals[1]
             max_diff = self.sensobs[0].sensor_count - 1 - max_
             self.match_degree = 1
-            if self.followed_time and time.time() - self.followed_time > 15:  # Avoid circles/loops
+            if self.followed_time and time.time() - self.followed_time > self.loop_time:
                 if min_ > max_diff:
-                    self.motor_recommendation = ('lf', 0.3)
+                    self.motor_recommendation = ('lf', self.speed)
                 else:
-                    self.motor_recommendation = ('rf', 0.3)
+                    self.motor_recommendation = ('rf', self.speed)
             else:
                 if not self.followed_time:
                     self.followed_time = time.time()
-                if min_ == 0 and max_ == 5:
+                if self.pid:
+                    self.follow()
+                elif min_ == 0 and max_ == 5:
                     self.motor_recommendation = (choice(('r', 'l')), 90)
                 elif min_ < 2:
                     self.motor_recommendation = ('l', 10)
                 elif max_diff < 2:
                     self.motor_recommendation = ('r', 10)
                 else:
-                    self.motor_recommendation = ('f', 0.3)
+                    self.motor_recommendation = ('f', self.speed)
+        elif self.pid and self.error is not None and time.time() - self.seen < self.search_time:
+            self.follow()
         else:
             self.match_degree = 0
             self.followed_time = 0
+            self.error = None
+            self.integral = 0.
+
+    # Set both wheel speeds from a PID controller on the line position, slowing down the further off centre the
+    # line is.  A lost line is steered towards as if it were at the outermost sensor on the side it was last seen.
+    def follow(self):
+        now = time.time()
+        line = self.sensobs[0]
+        position = line.position()
+        if position is not None:
+            error = position / (line.sensor_count - 1) * 2 - 1
+            self.seen = now
+        else:
+            error = -1. if self.error < 0 else 1.
+        derivative = 0.
+        if self.error is not None and now > self.last_time:
+            self.integral += error * (now - self.last_time)
+            derivative = (error - self.error) / (now - self.last_time)
+        self.error, self.last_time = error, now
+        steer = self.kp * error + self.ki * self.integral + self.kd * derivative
+        speed = self.speed * (1 - self.slowdown * abs(error))
+        self.match_degree = 1
+        self.motor_recommendation = ('v', (max(-1., min(1., speed + steer)), max(-1., min(1., speed - steer))))
 
 
 class ExploreBehaviour(Behaviour):
+    low_cost = True
+
     def __init__(self, *args, **kwargs):
         super(ExploreBehaviour, self).__init__(*args, **kwargs)
         self.match_degree = 1
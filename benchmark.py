@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# Timing of the hot spots in the control loop, runnable off the robot.
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from random import randint, seed
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from PIL import Image
+
+from simulation import CONFIGS, Simulation
+from camera import padded_size, yuv420_to_rgb
+from imager2 import ColorClassifier, Imager, np
+from sweep import simulate
+
+
+# The band counting ColorSensob did before Imager.color_bands: WTA through map_image2, then getpixel per pixel.
+def color_bands_pixels(image, rgb):
+    imager = Imager(image=image)
+    imager.use_arrays = False
+    imager = imager.map_color_wta()
+    left = 0
+    middle = 0
+    right = 0
+    for x in range(int(imager.xmax * 0.4)):
+        for y in range(imager.ymax):
+            if imager.get_pixel(x, y) == rgb:
+                left += 1
+    for x in range(int(imager.xmax * 0.4), int(imager.xmax * 0.6)):
+        for y in range(imager.ymax):
+            if imager.get_pixel(x, y) == rgb:
+                middle += 1
+    for x in range(int(imager.xmax * 0.6), imager.xmax):
+        for y in range(imager.ymax):
+            if imager.get_pixel(x, y) == rgb:
+                right += 1
+    left /= (imager.xmax * imager.ymax) * 0.4
+    middle /= (imager.xmax * imager.ymax) * 0.2
+    right /= (imager.xmax * imager.ymax) * 0.4
+    return left, middle, right
+
+
+# Noise with saturated red/green/blue pixels mixed in, so the WTA classification has something to find
+def random_pixel():
+    p = [randint(0, 255) for _ in range(3)]
+    if randint(0, 2) == 0:
+        p[randint(0, 2)] = 255
+    return tuple(p)
+
+
+def random_frame(width=128, height=96):
+    image = Image.new('RGB', (width, height))
+    image.putdata([random_pixel() for _ in range(width * height)])
+    return image
+
+
+# Mean seconds per call of func over the given frames
+def time_per_frame(func, frames, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for frame in frames:
+            func(frame)
+        elapsed = (perf_counter() - start) / len(frames)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_color_sensob(frames=10, color='green'):
+    seed(0)
+    images = [random_frame() for _ in range(frames)]
+    rgb = Imager._pixel_colors_[color]
+    for image in images:
+        assert Imager(image=image).color_bands(rgb) == color_bands_pixels(image, rgb)
+    pixels = time_per_frame(lambda im: color_bands_pixels(im, rgb), images)
+    bands = time_per_frame(lambda im: Imager(image=im).color_bands(rgb), images)
+    print("ColorSensob per frame: getpixel loops {:.2f} ms, color_bands {:.2f} ms ({:.0f}x)".format(
+        pixels * 1000, bands * 1000, pixels / bands))
+    colors = ('red', 'green', 'blue')
+    classifier = ColorClassifier(colors, bits=8)  # Exact, so the counts can be checked
+    for image in images:
+        assert classifier.bands(image) == {c: Imager(image=image).color_bands(Imager._pixel_colors_[c]) for c in colors}
+    each = time_per_frame(lambda im: [Imager(image=im).color_bands(Imager._pixel_colors_[c]) for c in colors], images)
+    shared = time_per_frame(classifier.bands, images)
+    print("Three colours per frame: color_bands each {:.2f} ms, ColorClassifier {:.2f} ms ({:.0f}x)".format(
+        each * 1000, shared * 1000, each / shared))
+
+
+# morphroll on two newsize x newsize images (as in imager2.ptest1), with and without the array backend, and
+# morphroll and mortun (as in imager2.ptest3) run eagerly and through LazyImager
+def bench_imager(newsize=250, steps=5, levels=4):
+    seed(0)
+    im1 = Imager(image=random_frame(newsize, newsize))
+    im2 = Imager(image=random_frame(newsize, newsize))
+    timings = {}
+    for use_arrays in (False, True):
+        Imager.use_arrays = use_arrays
+        timings[use_arrays] = time_per_frame(lambda im: im.morphroll(im2, steps=steps), [im1], repeat=1)
+    Imager.use_arrays = np is not None
+    print("morphroll {0}x{0}: pixel loops {1:.2f} s, arrays {2:.3f} s".format(
+        newsize, timings[False], timings[True]))
+
+    def copies(lazy):
+        a, b = Imager(image=im1.get_image().copy()), Imager(image=im2.get_image().copy())
+        return (a.lazy(), b.lazy()) if lazy else (a, b)
+
+    for name, func in (('morphroll', lambda a, b: a.morphroll(b, steps=steps)),
+                       ('mortun', lambda a, b: a.mortun(b, levels=levels))):
+        eager, lazy = (time_per_frame(lambda pair: func(*pair).get_image(), [copies(lazy) for _ in range(10)])
+                       for lazy in (False, True))
+        print("{0} {1}x{1}: eager {2:.2f} ms, lazy {3:.2f} ms".format(name, newsize, eager * 1000, lazy * 1000))
+
+
+# Decode plus ColorSensob analysis per frame, for a JPEG from raspivid and raw frames from raspividyuv
+def bench_capture_formats(frames=10, width=128, height=96, color='green'):
+    seed(0)
+    rgb = Imager._pixel_colors_[color]
+    pw, ph = padded_size(width, height)
+    jpegs, raws, yuvs = [], [], []
+    for _ in range(frames):
+        image = random_frame(pw, ph)
+        data = BytesIO()
+        image.crop((0, 0, width, height)).save(data, format='JPEG')
+        jpegs.append(data.getvalue())
+        raws.append(bytearray(image.tobytes()))
+        ycc = np.asarray(image.convert('YCbCr'))
+        yuvs.append(bytearray(ycc[..., 0].tobytes() + ycc[::2, ::2, 1].tobytes() + ycc[::2, ::2, 2].tobytes()))
+
+    def from_jpeg(data):
+        return Imager(image=Image.open(BytesIO(data)).convert('RGB')).color_bands(rgb)
+
+    def from_rgb(buf):
+        frame = np.frombuffer(buf, dtype=np.uint8).reshape(ph, pw, 3)[:height, :width]
+        return Imager(image=frame).color_bands(rgb)
+
+    def from_yuv(buf):
+        return Imager(image=yuv420_to_rgb(buf, width, height)).color_bands(rgb)
+
+    print("Capture format per frame: jpeg {:.2f} ms, rgb {:.2f} ms, yuv {:.2f} ms".format(
+        *(time_per_frame(f, data) * 1000 for f, data in ((from_jpeg, jpegs), (from_rgb, raws), (from_yuv, yuvs)))))
+
+
+LOOP_STAGES = ('update_sensobs', 'update_activity', 'update_behaviours', 'choose_action', 'update_motobs',
+               'invalidate_sensobs')
+
+
+def timed(func, samples):
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(perf_counter() - start)
+    return wrapper
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    stats = {'p{}'.format(p): ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in points}
+    stats['max'] = ordered[-1]
+    return stats
+
+
+# Run the real controller for the given number of ticks on simulated hardware, timing each stage of
+# run_one_timestep.  Returns per-stage percentiles (seconds) and the tick rate.
+def bench_control_loop(config='line', ticks=500, rate=10):
+    seed(0)
+    samples = {stage: [] for stage in LOOP_STAGES + ('tick',)}
+    with redirect_stdout(StringIO()), Simulation() as sim:
+        bbcon = sim.controller(config)
+        for stage in LOOP_STAGES:
+            owner = bbcon.arbitrator if stage == 'choose_action' else bbcon
+            setattr(owner, stage, timed(getattr(owner, stage), samples[stage]))
+        bbcon.run_one_timestep = timed(bbcon.run_one_timestep, samples['tick'])
+        scheduler = sim.scheduler(rate=rate)
+        scheduler.run(bbcon, max_ticks=ticks)
+    return {
+        'config': config,
+        'ticks': scheduler.ticks,
+        'ticks_per_second': len(samples['tick']) / sum(samples['tick']),
+        'stages': {stage: percentiles(samples[stage]) for stage in samples},
+    }
+
+
+def print_control_loop(result, baseline=None):
+    print("Control loop '{}': {:.0f} ticks/s".format(result['config'], result['ticks_per_second']))
+    for stage, stats in result['stages'].items():
+        line = "  {:<19}".format(stage) + " ".join("{} {:8.1f} us".format(k, v * 1e6) for k, v in stats.items())
+        old = baseline['stages'].get(stage, {}).get('p50') if baseline else None
+        if old and stats:
+            line += "  (p50 x{:.2f} vs baseline)".format(stats['p50'] / old)
+        print(line)
+
+
+# Run in a fresh interpreter: the robot's runner, bbcon.py, with extra_imports done first, up to the end of its
+# first tick.  Prints the time taken, the peak traced allocation and which heavy modules ended up loaded.  (The
+# peak RSS is no use here: a child process inherits its parent's.)
+STARTUP_SCRIPT = """
+import json, runpy, sys, time, tracemalloc
+tracemalloc.start()
+start = time.perf_counter()
+try:
+    import RPi.GPIO, wiringpi
+except ImportError:
+    from fake_hardware import install_fake_hardware
+    install_fake_hardware()
+{extra_imports}
+import scheduler
+
+
+# The tick alone: Scheduler.step would also sleep out the rest of the period, which is no part of starting up
+def first_tick(self, controller, max_ticks=None):
+    controller.run_one_timestep()
+    heavy = ('PIL', 'numpy', 'camera', 'imager2', 'ultrasonic', 'reflectance_sensors')
+    print(json.dumps({{'seconds': time.perf_counter() - start, 'peak_bytes': tracemalloc.get_traced_memory()[1],
+                      'loaded': [m for m in heavy if m in sys.modules]}}))
+    sys.exit()
+scheduler.Scheduler.run = first_tick
+sys.argv = ['bbcon.py']
+runpy.run_path('bbcon.py', run_name='__main__')
+"""
+
+# What importing bbcon used to load whatever the configuration: every driver, imager2 and PIL's filters
+EAGER_IMPORTS = "import camera, imager2, reflectance_sensors, ultrasonic\nfrom PIL import ImageEnhance, ImageFilter"
+
+
+# Time and memory from starting bbcon.py to the end of its first tick, line following only, as it imports things
+# now and with the imports it used to do, each the best of repeat fresh interpreters.  A fresh reflectance
+# calibration profile is saved beforehand, so the time is not spent calibrating.
+def bench_startup(repeat=5):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    with TemporaryDirectory() as home:
+        os.makedirs(os.path.join(home, '.zumo'))
+        with open(os.path.join(home, '.zumo', 'reflectance.json'), 'w') as f:
+            json.dump({'time': time(), 'max_val': [1000] * 6, 'min_val': [100] * 6}, f)
+        env = dict(os.environ, HOME=home)
+        for name, extra in (('lazy', ''), ('eager', EAGER_IMPORTS)):
+            command = [sys.executable, '-c', STARTUP_SCRIPT.format(extra_imports=extra)]
+            runs = [json.loads(subprocess.run(command, cwd=here, env=env, check=True, capture_output=True,
+                                              text=True).stdout) for _ in range(repeat)]
+            results[name] = min(runs, key=lambda r: r['seconds'])
+    for name, r in results.items():
+        print("bbcon.py to its first tick, {:<5} imports: {:6.1f} ms, peak traced {:6.0f} KB, loaded {}".format(
+            name, r['seconds'] * 1000, r['peak_bytes'] / 1024, ', '.join(r['loaded']) or '-'))
+
+
+# Simulated lap times of the discrete and the PID line following at several speeds, without the loop avoidance
+# turning off the track
+def bench_lap_time(ticks=1500, speeds=(0.3, 0.5, 0.7, 0.9)):
+    for config, name in (('line', 'discrete'), ('line-pid', 'PID')):
+        for speed in speeds:
+            r = simulate(config, {'line.speed': speed, 'line.loop_time': float('inf')}, 0, ticks, 10)
+            print("Line following, {:<8} speed {:.1f}: {:2d} laps, lap time {} s".format(
+                name, speed, r['laps'], '-' if r['lap_time'] is None else '{:.1f}'.format(r['lap_time'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the control loop hot spots")
+    parser.add_argument('benches', nargs='*', default=['color', 'imager', 'capture', 'loop', 'startup', 'laps'],
+                        choices=['color', 'imager', 'capture', 'loop', 'startup', 'laps'])
+    parser.add_argument('--configs', nargs='+', default=['line', 'line+camera', 'proximity+goal'],
+                        choices=list(CONFIGS))
+    parser.add_argument('--ticks', type=int, default=500)
+    parser.add_argument('--save', help="write the control loop results to this JSON file")
+    parser.add_argument('--baseline', help="compare the control loop results with this JSON file")
+    args = parser.parse_args()
+    if 'color' in args.benches:
+        bench_color_sensob()
+    if 'imager' in args.benches:
+        bench_imager()
+    if 'capture' in args.benches:
+        bench_capture_formats()
+    if 'startup' in args.benches:
+        bench_startup()
+    if 'laps' in args.benches:
+        bench_lap_time()
+    if 'loop' in args.benches:
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = {r['config']: r for r in json.load(f)}
+        results = [bench_control_loop(config, ticks=args.ticks) for config in args.configs]
+        for result in results:
+            print_control_loop(result, baseline.get(result['config']))
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=1)
@@ -1,19 +1,63 @@
 #!/usr/bin/env python3
 from PIL import Image
+from collections import deque
 from io import BytesIO
 import shlex
 import subprocess
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the raw capture formats
+    np = None
+
+
+# Raw frames from raspividyuv have their width padded to a multiple of 32 and their height to a multiple of 16
+def padded_size(width, height):
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+
+# Convert a padded YUV420 (I420) frame to a (height, width, 3) RGB array, using the JPEG/JFIF (full range BT.601)
+# coefficients that PIL uses for YCbCr.
+def yuv420_to_rgb(buf, width, height):
+    pw, ph = padded_size(width, height)
+    data = np.frombuffer(buf, dtype=np.uint8)
+    y = data[:pw * ph].reshape(ph, pw)[:height, :width].astype(np.float32)
+    chroma = (pw // 2) * (ph // 2)
+    u = data[pw * ph:pw * ph + chroma].reshape(ph // 2, pw // 2)
+    v = data[pw * ph + chroma:pw * ph + 2 * chroma].reshape(ph // 2, pw // 2)
+    u = u.repeat(2, axis=0).repeat(2, axis=1)[:height, :width] - 128.0
+    v = v.repeat(2, axis=0).repeat(2, axis=1)[:height, :width] - 128.0
+    rgb = np.stack((y + 1.402 * v, y - 0.344136 * u - 0.714136 * v, y + 1.772 * u), axis=2)
+    return np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
 
 
 class Camera():
-    def __init__(self, img_width=128, img_height=96, img_rot=0):
+    # With stream=True a single raspivid process keeps sending MJPEG frames, which a background thread decodes
+    # into a small ring buffer; get_value then returns the latest frame instead of starting raspistill.
+    # command replaces the capture command line (e.g. with fake_camera.py when testing off the robot).
+    # With format 'rgb' or 'yuv' the stream is raw frames from raspividyuv, read straight into preallocated
+    # buffers; the value is then a (height, width, 3) numpy array that Imager accepts in place of a PIL image.
+    def __init__(self, img_width=128, img_height=96, img_rot=0, stream=False, fps=30, buffer_size=3, command=None,
+                 format='jpeg'):
         self.value = None
         self.img_width = img_width
         self.img_height = img_height
         self.img_rot = img_rot
+        self.stream = stream
+        self.fps = fps
+        self.command = command
+        self.format = format
+        self.frames = deque(maxlen=buffer_size)
+        self.buffers = []
+        self.latest = None  # Index of the newest complete raw frame
+        self.held = None  # Index of the raw frame last handed out, which the reader must not overwrite
+        self.frame_ready = threading.Condition()
+        self.process = None
+        self.reader = None
 
     def get_value(self):
-        if not self.value:
+        if self.value is None:
             return self.update()
         return self.value
 
@@ -25,18 +69,154 @@ class Camera():
         self.value = None
 
     def sensor_get_value(self):
+        if self.stream:
+            self.value = self.latest_frame()
+            return
+
+        self.finish_capture(self.begin_capture())
+
+    # Start raspistill without waiting for it.  The picture is taken once the camera has started up and delay
+    # seconds have passed, so the start-up can overlap something else, such as the robot turning into place.
+    # Pass the result to finish_capture.  In stream mode nothing is started and finish_capture takes the
+    # latest frame.
+    def begin_capture(self, delay=0.001):
+        if self.stream:
+            return None
         # use raspicam to take an image, with JPG output stored as bytes
-        image = subprocess.Popen(
-            shlex.split("raspistill -t 1 -o - ") + list(map(str,[
+        return subprocess.Popen(
+            shlex.split("raspistill -o - ") + list(map(str,[
+                "-t", max(1, round(delay * 1000)),
                 "-w", self.img_width,
                 "-h", self.img_height,
                 "-rot", self.img_rot,
             ])),
             stdout=subprocess.PIPE,
-        ).communicate()[0]
-        
+        )
+
+    def finish_capture(self, capture):
+        if capture is None:
+            return self.update()
+        image = capture.communicate()[0]
         # Open the image just taken by raspicam
         self.value = Image.open(BytesIO(image)).convert('RGB')
+        return self.value
+
+    # Get the first, slow capture out of the way: start the stream and wait for its first frame, or take a
+    # picture.  Returns the camera, to wrap a constructor.
+    def warm_up(self):
+        if self.stream:
+            self.latest_frame()
+        else:
+            self.update()
+        return self
+
+    def capture_command(self):
+        if self.command:
+            return list(self.command)
+        if self.format in ('rgb', 'yuv'):
+            return shlex.split("raspividyuv -t 0 -n -o -") + (["-rgb"] if self.format == 'rgb' else []) + list(
+                map(str, ["-w", self.img_width, "-h", self.img_height, "-rot", self.img_rot, "-fps", self.fps]))
+        return shlex.split("raspivid -t 0 -n -cd MJPEG -o -") + list(map(str, [
+            "-w", self.img_width,
+            "-h", self.img_height,
+            "-rot", self.img_rot,
+            "-fps", self.fps,
+        ]))
+
+    # Start the capture process and the reader thread, if they are not already running
+    def start(self):
+        if self.process is None:
+            if self.format not in ('jpeg', 'rgb', 'yuv'):
+                raise ValueError("Invalid capture format. {}".format(self.format))
+            raw = self.format != 'jpeg'
+            if raw and not self.buffers:
+                pw, ph = padded_size(self.img_width, self.img_height)
+                frame_size = pw * ph * 3 if self.format == 'rgb' else pw * ph * 3 // 2
+                self.buffers = [bytearray(frame_size) for _ in range(max(self.frames.maxlen, 3))]
+            self.process = subprocess.Popen(self.capture_command(), stdout=subprocess.PIPE, bufsize=0)
+            self.reader = threading.Thread(target=self._read_raw_frames if raw else self._read_frames, daemon=True)
+            self.reader.start()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.reader.join()
+            self.process = None
+            self.reader = None
+
+    # Blocks only until the first frame has arrived
+    def latest_frame(self, timeout=5):
+        self.start()
+        if self.format != 'jpeg':
+            return self.latest_raw_frame(timeout)
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.frames or not self.reader.is_alive(), timeout)
+            if not self.frames:
+                raise IOError("No frame from camera command {}".format(self.capture_command()))
+            return self.frames[-1]
+
+    # RGB frames are returned as a view of the capture buffer, which stays untouched until the next call.
+    def latest_raw_frame(self, timeout=5):
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.latest is not None or not self.reader.is_alive(), timeout)
+            if self.latest is None:
+                raise IOError("No frame from camera command {}".format(self.capture_command()))
+            self.held = self.latest
+            buf = self.buffers[self.held]
+        if self.format == 'yuv':
+            return yuv420_to_rgb(buf, self.img_width, self.img_height)
+        pw, ph = padded_size(self.img_width, self.img_height)
+        return np.frombuffer(buf, dtype=np.uint8).reshape(ph, pw, 3)[:self.img_height, :self.img_width]
+
+    # Split the MJPEG stream on the JPEG start/end markers.  Only the newest complete frame of each read is
+    # decoded, so a slow consumer does not make the reader fall behind.
+    def _read_frames(self):
+        pipe = self.process.stdout
+        data = bytearray()
+        while True:
+            chunk = pipe.read(1 << 16)
+            if not chunk:
+                break
+            data += chunk
+            jpeg = None
+            while True:
+                start = data.find(b'\xff\xd8')
+                end = data.find(b'\xff\xd9', start + 2) if start >= 0 else -1
+                if end < 0:
+                    if start > 0:
+                        del data[:start]
+                    elif start < 0:
+                        del data[:-1]
+                    break
+                jpeg = bytes(data[start:end + 2])
+                del data[:end + 2]
+            if jpeg is not None:
+                frame = Image.open(BytesIO(jpeg)).convert('RGB')
+                with self.frame_ready:
+                    self.frames.append(frame)
+                    self.frame_ready.notify_all()
+        with self.frame_ready:
+            self.frame_ready.notify_all()
+
+    # Fill the free buffer that is neither the newest frame nor the one handed out, then publish it
+    def _read_raw_frames(self):
+        pipe = self.process.stdout
+        while True:
+            with self.frame_ready:
+                slot = next(i for i in range(len(self.buffers)) if i not in (self.latest, self.held))
+            view = memoryview(self.buffers[slot])
+            got = 0
+            while got < len(view):
+                n = pipe.readinto(view[got:])
+                if not n:
+                    with self.frame_ready:
+                        self.frame_ready.notify_all()
+                    return
+                got += n
+            with self.frame_ready:
+                self.latest = slot
+                self.frame_ready.notify_all()
     
     def show(self): # debug
         self.get_value().show() # fim, vx or imagemagic must be installed. x forwarding preferred
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Stand-in for raspivid when testing Camera(stream=True) off the robot: writes MJPEG frames to stdout.
+# Takes the same -w/-h/-fps options (others are ignored). Each frame is a solid colour, cycling red/green/blue.
+# With -rgb it writes raw RGB frames like raspividyuv -rgb, padded to 32x16 blocks.
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+
+def main(args):
+    opts = dict(zip(args, args[1:]))
+    size = (int(opts.get('-w', 128)), int(opts.get('-h', 96)))
+    period = 1 / float(opts.get('-fps', 30))
+    colors = ((255, 0, 0), (0, 255, 0), (0, 0, 255))
+    out = sys.stdout.buffer
+    i = 0
+    raw = '-rgb' in args
+    padded = ((size[0] + 31) // 32 * 32, (size[1] + 15) // 16 * 16)
+    while True:
+        if raw:
+            out.write(bytes(colors[i % len(colors)]) * (padded[0] * padded[1]))
+        else:
+            frame = BytesIO()
+            Image.new('RGB', size, colors[i % len(colors)]).save(frame, format='JPEG')
+            out.write(frame.getvalue())
+        out.flush()
+        i += 1
+        time.sleep(period)
+
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv[1:])
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
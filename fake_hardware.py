@@ -0,0 +1,20 @@
+import sys
+import types
+
+
+# Stand-ins for RPi.GPIO and wiringpi, installed only when the real modules are missing so the drivers can be
+# imported off the robot.  Inputs read low, which ZumoButton takes as a button press.
+def install_fake_hardware():
+    gpio = types.ModuleType('RPi.GPIO')
+    gpio.BOARD, gpio.BCM, gpio.IN, gpio.OUT, gpio.LOW, gpio.HIGH = 10, 11, 1, 0, 0, 1
+    gpio.RISING, gpio.FALLING, gpio.BOTH = 31, 32, 33
+    for name in ('setmode', 'setup', 'output', 'cleanup', 'add_event_detect', 'remove_event_detect'):
+        setattr(gpio, name, lambda *args, **kwargs: None)
+    gpio.input = lambda pin: 0
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    wiringpi = types.ModuleType('wiringpi')
+    for name in ('wiringPiSetupGpio', 'pinMode', 'pwmWrite', 'digitalWrite', 'pullUpDnControl'):
+        setattr(wiringpi, name, lambda *args: None)
+    wiringpi.digitalRead = lambda pin: 0
+    sys.modules.update({'RPi': rpi, 'RPi.GPIO': gpio, 'wiringpi': wiringpi})
@@ -1,23 +1,46 @@
 from PIL import Image
-from PIL import ImageFilter
-from PIL import ImageEnhance
+
+try:
+    import numpy as np
+except ImportError:  # The per-pixel PIL loops are used instead
+    np = None
 
 
 class Imager():
 
     _pixel_colors_ = {'red':(255,0,0), 'green': (0,255,0), 'blue': (0,0,255), 'white': (255,255,255),
                       'black': (0,0,0)}
+    # When True (and numpy is available), the pixel-level operations work on whole-image arrays instead of
+    # calling getpixel/putpixel for each pixel.
+    use_arrays = np is not None
 
     def __init__(self,fid=False,image=False,width=100,height=100,background='black',mode='RGB'):
         self.fid = fid # The image file
-        self.image = image # A PIL image object
+        self.image = image # A PIL image object, or a (height, width, 3) uint8 array such as a raw camera frame
         self.xmax = width; self.ymax = height # These can change if there's an input image or file
         self.mode = mode
         self.init_image(background=background)
 
+    # An array given as the image is used as is by the array operations; a PIL image is only made from it
+    # (and then replaces it) when something asks for self.image.
+    @property
+    def image(self):
+        if self._image is None and self.array is not None:
+            self._image = Image.fromarray(self.array)
+            self.array = None
+        return self._image
+
+    @image.setter
+    def image(self,im):
+        if np is not None and isinstance(im, np.ndarray):
+            self.array = im; self._image = None
+        else:
+            self.array = None; self._image = im
+
     def init_image(self,background='black'):
         if self.fid: self.load_image()
-        if self.image: self.get_image_dims()
+        if self.array is not None: self.ymax, self.xmax = self.array.shape[:2]
+        elif self.image: self.get_image_dims()
         else: self.image = self.gen_plain_image(self.xmax,self.ymax,background)
 
     # Load image from file
@@ -63,7 +86,21 @@ class Imager():
     def get_pixel(self,x,y): return self.image.getpixel((x,y))
     def set_pixel(self,x,y,rgb): self.image.putpixel((x,y),rgb)
 
+    # The image as a read-only (height, width[, bands]) uint8 array.  PIL keeps RGB pixels padded to 4 bytes,
+    # so this is one bulk copy of the pixel data rather than a view.
+    def get_array(self,image=False):
+        if not image and self.array is not None:
+            return self.array
+        return np.asarray(image if image else self.image)
+
+    # Build an Imager from an array like the one get_array returns.  Values are clipped to 0..255.
+    def from_array(self,a):
+        return Imager(image=Image.fromarray(np.clip(a, 0, 255).astype(np.uint8)))
+
+    # Works on single pixels as well as on whole-image arrays (as used by morph).
     def combine_pixels(self,p1,p2,alpha=0.5):
+        if np is not None and isinstance(p1, np.ndarray):
+            return np.rint(alpha*p1.astype(float) + (1 - alpha)*p2.astype(float))
         return tuple([round(alpha*p1[i] + (1 - alpha)*p2[i]) for i in range(3)])
 
     # The use of Image.eval applies the func to each BAND, independently, if image pixels are RGB tuples.
@@ -73,9 +110,14 @@ class Imager():
         return Imager(image=Image.eval(image,func)) # Eval creates a new image, so no need for me to do a copy.
 
     # This applies the function to each RGB TUPLE, returning a new tuple to appear in the new image.  So func
-    # must return a 3-tuple if the image has RGB pixels.
-
-    def map_image2(self,func,image=False):
+    # must return a 3-tuple if the image has RGB pixels.  With vectorized=True, func is instead called once
+    # with the (height, width, 3) array of the image and must return an array of the same shape.
+
+    def map_image2(self,func,image=False,vectorized=False):
+        if vectorized:
+            return self.from_array(func(self.get_array(image)))
+        if self.use_arrays and (image if image else self.image).mode == 'RGB':
+            return self._map_distinct_pixels(func,image)
         im2 = image.copy() if image else self.image.copy()
         for i in range(self.xmax):
             for j in range(self.ymax):
@@ -92,13 +134,36 @@ class Imager():
                 return tuple([(x if x == w else 0) for x in p])
             else:
                 return (0,0,0)
+        if self.use_arrays:
+            return self.from_array(self.wta_array(image,thresh))
         return self.map_image2(wta,image)
 
+    # Same classification as map_color_wta, done in one pass over an (height, width, 3) array of the image.
+    def wta_array(self,image=False,thresh=0.34):
+        return _wta(self.get_array(image),thresh)
+
+    # Fractions of the left (40%), middle (20%) and right (40%) bands of the image whose pixels are exactly rgb
+    # after WTA classification.
+    def color_bands(self,rgb,thresh=0.34):
+        x1 = int(self.xmax * 0.4); x2 = int(self.xmax * 0.6)
+        if self.use_arrays:
+            hits = np.all(self.wta_array(thresh=thresh) == rgb, axis=2)
+            counts = [int(hits[:, x0:xn].sum()) for x0, xn in ((0, x1), (x1, x2), (x2, self.xmax))]
+        else:
+            wta = self.map_color_wta(thresh=thresh)
+            counts = [sum(1 for x in range(x0, xn) for y in range(wta.ymax) if wta.get_pixel(x, y) == rgb)
+                      for x0, xn in ((0, x1), (x1, x2), (x2, self.xmax))]
+        area = self.xmax * self.ymax
+        return counts[0] / (area * 0.4), counts[1] / (area * 0.2), counts[2] / (area * 0.4)
+
+    def _map_distinct_pixels(self,func,image=False):
+        return self.from_array(_map_distinct(self.get_array(image),func))
 
     # Note that grayscale uses the RGB triple to define shades of gray.
     def gen_grayscale(self,image=False): return self.scale_colors(image=image,degree=0)
 
     def scale_colors(self,image=False,degree=0.5):
+        from PIL import ImageEnhance  # Only loaded when needed
         image = image if image else self.image
         return Imager(image=ImageEnhance.Color(image).enhance(degree))
 
@@ -130,6 +195,8 @@ class Imager():
 
     # This requires self and im2 to be of the same size
     def morph(self,im2,alpha=0.5):
+        if self.use_arrays:
+            return self.from_array(self.combine_pixels(self.get_array(), im2.get_array(), alpha=alpha))
         im3 = Imager(width=self.xmax,height=self.ymax) # Creates a plain image
         for x in range(self.xmax):
             for y in range(self.ymax):
@@ -165,6 +232,281 @@ class Imager():
     def mortun(self,im2,levels=5,scale=0.75):
         return self.tunnel(levels,scale).morph4(im2.tunnel(levels,scale))
 
+    # A LazyImager of this image, for running a chain of operations in one go (or self if numpy is missing)
+    def lazy(self):
+        return LazyImager(self) if np is not None else self
+
+
+# The WTA classification of an (height, width, 3) array: each pixel keeps only its dominant band, or goes black.
+def _wta(a,thresh=0.34):
+    a = a.astype(np.int64)
+    s = a.sum(axis=2); w = a.max(axis=2)
+    share = np.divide(w, s, out=np.zeros(s.shape), where=s > 0)
+    keep = (s > 0) & (share >= thresh)
+    return np.where((a == w[..., None]) & keep[..., None], a, 0)
+
+# Calls func once per distinct RGB tuple of an (height, width, 3) array and scatters the results back with an
+# index array.
+def _map_distinct(a,func):
+    a = a.astype(np.int32)
+    keys = (a[..., 0] << 16) | (a[..., 1] << 8) | a[..., 2]
+    colors, index = np.unique(keys, return_inverse=True)
+    table = np.array([func((int(k) >> 16, (int(k) >> 8) & 255, int(k) & 255)) for k in colors], dtype=np.uint8)
+    return table[index.reshape(keys.shape)]
+
+# Rounds and clips a float array in place, returning it as uint8
+def _quantize(a):
+    np.rint(a, out=a); np.clip(a, 0, 255, out=a)
+    return a.astype(np.uint8)
+
+# The weights PIL uses to turn RGB into L (0.299, 0.587 and 0.114 in 16-bit fixed point), as used by
+# ImageEnhance.Color
+_luma = (19595, 38470, 7471)
+
+
+class LazyImager(Imager):
+    # Records operations instead of running them, and only computes the image when something asks for it
+    # (get_image, dump_image, display, get_array, ...).  Runs of pixel-wise steps (map_image, map_image2,
+    # map_color_wta, scale_colors and morph) are applied in one pass to a single float array, with no images,
+    # Imagers or rounding in between, except that scale_colors rounds and truncates as PIL does.  A single step
+    # gives exactly the eager result; band lookups are composed into one table and consecutive scale_colors
+    # into one degree, so a chain can differ from the eager one by a level of rounding.  resize, tunnel and
+    # the concatenations need whole images and are computed (once) where they stand in the chain; nested
+    # concatenations are flattened into one canvas.  Unlike Imager.tunnel, tunnel leaves self unchanged.
+    def __init__(self,source,steps=(),size=None,parts=None):
+        self.fid = False
+        self.mode = 'RGB'
+        self._image = None; self.array = None
+        self.source = source # An Imager, or a function returning the image the steps start from
+        self.steps = list(steps) # (op, args) tuples
+        self.parts = parts # (imager, x, y) of a concatenation not yet computed
+        self.xmax, self.ymax = size if size else (source.xmax, source.ymax)
+
+    def get_lazy_image(self):
+        if self._image is None and self.array is None:
+            if not self.steps and not callable(self.source):
+                Imager.image.fset(self,self.source.image) # Nothing to do but share the source image
+            else:
+                self.array = _quantize(self.compute())
+            self.source = None; self.steps = []; self.parts = None # Let go of the graph
+        return Imager.image.fget(self)
+
+    def set_lazy_image(self,im):
+        self.source = None; self.steps = []; self.parts = None
+        Imager.image.fset(self,im)
+
+    image = property(get_lazy_image,set_lazy_image)
+
+    def computed(self):
+        return self._image is not None or self.array is not None
+
+    def lazy(self):
+        return self
+
+    # The image as a new float (height, width, 3) array, without caching it
+    def compute(self):
+        if self.computed():
+            return self.get_array().astype(np.float32)
+        if callable(self.source):
+            self.source = Imager(image=self.source()) # Computed once, however often it is used
+            self.parts = None
+        if isinstance(self.source, LazyImager):
+            a = self.source.compute()
+        else:
+            image = self.source.array if self.source.array is not None else self.source.image
+            if not isinstance(image, np.ndarray) and image.mode != 'RGB':
+                image = image.convert('RGB')
+            a = np.array(image, dtype=np.float32)
+        for op, args in self.steps:
+            a = getattr(self, '_' + op)(a, *args)
+        return a
+
+    # A new LazyImager with step added to this one's, merged into the last step where the two fuse.  A computed
+    # image or one made by resize, tunnel or a concatenation is the start of a new run instead, so that it is
+    # computed only once however many runs start from it.
+    def _then(self,op,*args):
+        if self.computed() or callable(self.source):
+            return LazyImager(self, [(op, args)])
+        steps = list(self.steps)
+        if steps and steps[-1][0] == op == 'point':
+            steps[-1] = ('point', (args[0][steps[-1][1][0]],))
+        elif steps and steps[-1][0] == op == 'color':
+            steps[-1] = ('color', (steps[-1][1][0] * args[0],))
+        else:
+            steps.append((op, args))
+        return LazyImager(self.source, steps, (self.xmax, self.ymax))
+
+    @staticmethod
+    def _point(a,lut):
+        return lut[_quantize(a)].astype(np.float32)
+
+    @staticmethod
+    def _pixel(a,func):
+        return _map_distinct(_quantize(a),func).astype(np.float32)
+
+    @staticmethod
+    def _vectorized(a,func):
+        return np.clip(func(_quantize(a)), 0, 255).astype(np.uint8).astype(np.float32)
+
+    @staticmethod
+    def _wta(a,thresh):
+        return _wta(_quantize(a),thresh).astype(np.float32)
+
+    # As ImageEnhance.Color does it: a blend with the rounded L of the pixels, in single precision and truncated
+    @staticmethod
+    def _color(a,degree):
+        q = _quantize(a).astype(np.int32)
+        gray = ((q @ np.array(_luma, dtype=np.int32) + 0x8000) >> 16).astype(np.float32)[..., None]
+        a = gray + np.float32(degree) * (q.astype(np.float32) - gray)
+        np.clip(a, 0, 255, out=a)
+        return np.trunc(a, out=a)
+
+    # In double precision, as combine_pixels does it
+    @staticmethod
+    def _blend(a,im2,alpha):
+        a = alpha * a.astype(np.float64)
+        a += (1 - alpha) * (im2.compute() if isinstance(im2, LazyImager) else im2.get_array()).astype(np.float64)
+        return a
+
+    def map_image(self,func,image=False):
+        if image: return Imager.map_image(self,func,image)
+        ramp = Image.frombytes('L', (256, 1), bytes(range(256)))
+        return self._then('point', np.frombuffer(Image.eval(ramp, func).tobytes(), dtype=np.uint8))
+
+    def map_image2(self,func,image=False,vectorized=False):
+        if image: return Imager.map_image2(self,func,image,vectorized)
+        return self._then('vectorized' if vectorized else 'pixel', func)
+
+    def map_color_wta(self,image=False,thresh=0.34):
+        if image: return Imager.map_color_wta(self,image,thresh)
+        return self._then('wta', thresh)
+
+    def scale_colors(self,image=False,degree=0.5):
+        if image: return Imager.scale_colors(self,image,degree)
+        return self._then('color', degree)
+
+    def morph(self,im2,alpha=0.5):
+        return self._then('blend', im2, alpha)
+
+    def resize(self,new_width,new_height,image=False):
+        if image: return Imager.resize(self,new_width,new_height,image)
+        return LazyImager(lambda: self.image.resize((new_width,new_height)), size=(new_width,new_height))
+
+    def tunnel(self,levels=5,scale=0.75):
+        if levels == 0: return self
+        def tunnel():
+            return Imager(image=self.image.copy()).tunnel(levels,scale).image
+        return LazyImager(tunnel, size=(self.xmax,self.ymax))
+
+    # The pieces of a concatenation this one can be merged into, offset by (x0, y0)
+    def _parts(self,x0,y0,background):
+        if self.parts is not None and not self.steps and not self.computed() and self.background == background:
+            return [(im, x + x0, y + y0) for im, x, y in self.parts]
+        return [(self, x0, y0)]
+
+    def _concat(self,parts,width,height,background):
+        def paste():
+            canvas = self.gen_plain_image(width,height,background)
+            for im, x, y in parts:
+                canvas.paste(im.get_image(),(x,y,x+im.xmax,y+im.ymax))
+            return canvas
+        im3 = LazyImager(paste, size=(width,height), parts=parts)
+        im3.background = background
+        return im3
+
+    def concat_vert(self,im2=False,background='black'):
+        im2 = im2 if im2 else self
+        parts = self._parts(0,0,background) + _lazy_parts(im2,0,self.ymax,background)
+        return self._concat(parts,max(self.xmax,im2.xmax),self.ymax+im2.ymax,background)
+
+    def concat_horiz(self,im2=False,background='black'):
+        im2 = im2 if im2 else self
+        parts = self._parts(0,0,background) + _lazy_parts(im2,self.xmax,0,background)
+        return self._concat(parts,self.xmax+im2.xmax,max(self.ymax,im2.ymax),background)
+
+def _lazy_parts(im,x0,y0,background):
+    return im._parts(x0,y0,background) if isinstance(im, LazyImager) else [(im, x0, y0)]
+
+class ColorClassifier():
+    # Labels every pixel of a frame with one lookup in a table indexed by the top bits bits of its R, G and B
+    # values.  Label 0 is no colour and label i is colors[i-1].  The table either follows the WTA rule of
+    # map_color_wta (a pixel has a colour when it is exactly that colour after WTA, which with bits=8 gives the
+    # same counts as color_bands) or is trained from sample frames.  The table has 2**(3*bits) one-byte entries:
+    # the default 6 bits give 256 KB and band fractions within about 0.02 of color_bands, 5 bits 32 KB within
+    # about 0.03, while 8 bits are exact but take 16 MB.  Needs numpy.
+    _wta_tables = {} # (colors, thresh, bits) -> table, shared by all classifiers
+
+    def __init__(self,colors=('red','green','blue'),thresh=0.34,bits=6,table=None):
+        self.colors = list(colors)
+        self.bits = bits
+        self.table = table if table is not None else self.wta_table(self.colors,thresh,bits)
+
+    # With fewer than 8 bits each bucket is judged by its brightest member, so near-saturated pixels count too.
+    # Only the buckets that can possibly give a colour are examined: its nonzero bands must all be the band
+    # maximum m and the others below it, so for a primary colour that is one plane of the cube.
+    @classmethod
+    def wta_table(cls,colors,thresh=0.34,bits=6):
+        key = (tuple(colors),thresh,bits)
+        if key not in cls._wta_tables:
+            n = 1 << bits; shift = 8 - bits
+            values = (np.arange(n) << shift) | ((1 << shift) - 1)
+            cube = np.zeros((n, n, n), dtype=np.uint8)
+            for label, color in enumerate(colors, 1):
+                rgb = Imager._pixel_colors_[color]; m = max(rgb)
+                if m == 0: # Black: whatever WTA blacks out, a plane at a time
+                    g, b = np.meshgrid(values, values, indexing='ij')
+                    for r in range(n):
+                        black = np.all(_wta(np.stack((np.full_like(g, values[r]), g, b), axis=2),thresh) == 0, axis=2)
+                        cube[r][black & (cube[r] == 0)] = label
+                    continue
+                if any(0 < v < m for v in rgb):
+                    continue # Not a possible WTA result
+                index = np.ix_(*[np.flatnonzero(values == m if v else values < m) for v in rgb])
+                total = values[index[0]] + values[index[1]] + values[index[2]]
+                sub = cube[index]
+                sub[(m / total >= thresh) & (sub == 0)] = label # The first colour wins a tie
+                cube[index] = sub
+            cls._wta_tables[key] = cube.ravel()
+        return cls._wta_tables[key]
+
+    # A classifier whose table gives each bucket the label with the most sample pixels in it.  samples maps
+    # colour names (None for background) to lists of frames; buckets without samples are background.
+    @classmethod
+    def train(cls,samples,bits=5):
+        colors = [c for c in samples if c is not None]
+        votes = np.zeros((1 << (3 * bits), len(colors) + 1), dtype=np.int64)
+        for label, color in enumerate([None] + colors):
+            for frame in samples.get(color, ()):
+                votes[:, label] += np.bincount(_color_index(_rgb_array(frame),bits).ravel(), minlength=len(votes))
+        return cls(colors,bits=bits,table=votes.argmax(axis=1).astype(np.uint8))
+
+    # A (height, width) array of labels
+    def labels(self,frame):
+        return self.table[_color_index(_rgb_array(frame),self.bits)]
+
+    # {colour: fractions of the left (40%), middle (20%) and right (40%) bands with that colour}, as
+    # color_bands gives for one colour
+    def bands(self,frame):
+        labels = self.labels(frame)
+        height, width = labels.shape
+        x1 = int(width * 0.4); x2 = int(width * 0.6)
+        area = width * height
+        counts = [np.bincount(labels[:, x0:xn].ravel(), minlength=len(self.colors) + 1).tolist()
+                  for x0, xn in ((0, x1), (x1, x2), (x2, width))]
+        return {color: (counts[0][i] / (area * 0.4), counts[1][i] / (area * 0.2), counts[2][i] / (area * 0.4))
+                for i, color in enumerate(self.colors, 1)}
+
+def _rgb_array(frame):
+    if isinstance(frame, Imager): frame = frame.get_array()
+    elif not isinstance(frame, np.ndarray) and frame.mode != 'RGB': frame = frame.convert('RGB')
+    return np.asarray(frame)
+
+# The index of each pixel's bucket in a classifier table of the given bits
+def _color_index(a,bits):
+    shift = 8 - bits
+    q = (a >> shift).astype(np.int32) if shift else a.astype(np.int32)
+    return (q[..., 0] << (2 * bits)) | (q[..., 1] << bits) | q[..., 2]
+
 ### *********** TESTS ************************
 
 # Note: the default file paths for these examples are for unix!
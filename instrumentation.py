@@ -0,0 +1,120 @@
+from array import array
+import csv
+import struct
+import time
+
+
+class Instrumentation:
+    # Times the calls of a controller's sensobs, behaviours and arbitrator into a preallocated ring buffer that
+    # keeps the newest capacity records.  It works by wrapping the methods of the watched objects, so nothing
+    # is added to a controller that is not instrumented.  Attach with BBCON.instrument.
+    methods = {
+        'sensob': ('update', 'get_value'),
+        'behaviour': ('update_activity', 'sense_and_act'),
+        'arbitrator': ('choose_action',),
+        'controller': ('run_one_timestep',),
+    }
+    magic = b'ZINS1'
+    record_format = struct.Struct('<IHdd')  # tick, event, start, duration
+
+    def __init__(self, capacity=100000, clock=time.perf_counter):
+        self.capacity = capacity
+        self.clock = clock
+        self.ticks = array('I', bytes(4 * capacity))
+        self.events = array('H', bytes(2 * capacity))
+        self.starts = array('d', bytes(8 * capacity))
+        self.durations = array('d', bytes(8 * capacity))
+        self.count = 0  # Records written, including those overwritten since
+        self.tick = 0
+        self.names = []
+        self.watched = {}  # id(obj) -> (obj, wrapped method names)
+
+    def event_id(self, name):
+        try:
+            return self.names.index(name)
+        except ValueError:
+            self.names.append(name)
+            return len(self.names) - 1
+
+    def record(self, event, start, duration):
+        i = self.count % self.capacity
+        self.ticks[i] = self.tick
+        self.events[i] = event
+        self.starts[i] = start
+        self.durations[i] = duration
+        self.count += 1
+
+    # Replace obj's methods of the given kind with timed versions
+    def watch(self, obj, kind):
+        if id(obj) in self.watched:
+            return
+        for method in self.methods[kind]:
+            self._wrap(obj, method, kind == 'controller')
+        self.watched[id(obj)] = (obj, self.methods[kind])
+
+    def unwatch_all(self):
+        for obj, methods in self.watched.values():
+            for method in methods:
+                obj.__dict__.pop(method, None)
+        self.watched = {}
+
+    def _wrap(self, obj, method, counts_ticks):
+        func = getattr(obj, method)
+        event = self.event_id('{}.{}'.format(type(obj).__name__, method))
+        clock, record = self.clock, self.record
+
+        def timed(*args, **kwargs):
+            if counts_ticks:
+                self.tick += 1
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(event, start, clock() - start)
+        setattr(obj, method, timed)
+
+    # (tick, event name, start, duration) for the records still in the buffer, oldest first
+    def records(self):
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            i = n % self.capacity
+            yield self.ticks[i], self.names[self.events[i]], self.starts[i], self.durations[i]
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('tick', 'event', 'start', 'duration'))
+            writer.writerows(self.records())
+
+    # Binary dump: magic, the event names (count, then length-prefixed UTF-8), the record count, then the
+    # records packed with record_format
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.magic)
+            f.write(struct.pack('<H', len(self.names)))
+            for name in self.names:
+                data = name.encode()
+                f.write(struct.pack('<H', len(data)) + data)
+            first = max(0, self.count - self.capacity)
+            f.write(struct.pack('<I', self.count - first))
+            for n in range(first, self.count):
+                i = n % self.capacity
+                f.write(self.record_format.pack(self.ticks[i], self.events[i], self.starts[i], self.durations[i]))
+
+    # The records of a binary dump, as returned by records()
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(cls.magic):
+            raise ValueError("Not an instrumentation dump: {}".format(path))
+        offset = len(cls.magic)
+        names = []
+        for _ in range(struct.unpack_from('<H', data, offset)[0]):
+            offset += 2
+            length = struct.unpack_from('<H', data, offset)[0]
+            names.append(data[offset + 2:offset + 2 + length].decode())
+            offset += length
+        count = struct.unpack_from('<I', data, offset + 2)[0]
+        records = cls.record_format.iter_unpack(data[offset + 6:offset + 6 + count * cls.record_format.size])
+        return [(tick, names[event], start, duration) for tick, event, start, duration in records]
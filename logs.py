@@ -0,0 +1,67 @@
+import atexit
+from copy import copy
+import logging
+import logging.handlers
+import queue
+import threading
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Hands records to the writer thread, which formats them, and drops them (counting) when the queue is full,
+    # so logging never blocks the control loop.  Only the message is merged with its arguments up front, as the
+    # arguments (e.g. a list of readings) may have changed by the time the writer gets to them.
+    def __init__(self, records):
+        super(DroppingQueueHandler, self).__init__(records)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()  # Records are dropped by whichever thread logs them
+
+    def prepare(self, record):
+        record = copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+
+_listener = None
+_handler = None
+
+
+# Send the records of all modules at or above level to a bounded queue, written to stream (default stderr) or
+# filename by a background thread.  Modules log through logging.getLogger(__name__); until start() is called
+# only warnings and errors are shown.
+def start(level=logging.INFO, stream=None, filename=None, capacity=1000,
+          fmt='%(relativeCreated)8d %(levelname)-7s %(name)s: %(message)s'):
+    global _listener, _handler
+    stop()
+    output = logging.FileHandler(filename) if filename else logging.StreamHandler(stream)
+    output.setFormatter(logging.Formatter(fmt))
+    records = queue.Queue(capacity)
+    _handler = DroppingQueueHandler(records)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+
+
+# Write out what is still queued and detach the writer
+def stop():
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
+
+
+def dropped():
+    return _handler.dropped if _handler is not None else 0
+
+
+atexit.register(stop)
@@ -1,15 +1,56 @@
+from collections import deque
+import time
+
 from motors import Motors
 
 
 class Motob:
-    def __init__(self):
-        self.motors = Motors()
+    max_speed = 50.  # Forward speed in cm/s at full duty cycle, roughly
+
+    # blocking=False makes update return at once, with the motors stopped by a timer after the command's duration.
+    # clock times the commands in the history.
+    def __init__(self, blocking=True, motors=None, clock=time.monotonic):
+        self.motors = motors if motors is not None else Motors(blocking=blocking)
+        self.clock = clock
         self.value = None
+        self.history = deque(maxlen=16)  # (start, end, forward speed fraction, turns) of the latest commands
 
     def update(self, v):
         self.value = v
+        self.record()
         self.operationalize()
 
+    # Note when the command starts, how long it lasts, how fast it moves the robot forward and whether it turns
+    # the robot.  A command cuts the previous one short.
+    def record(self):
+        now = self.clock()
+        if self.history and self.history[-1][1] > now:
+            self.history[-1] = (self.history[-1][0], now) + self.history[-1][2:]
+        t, s = self.value
+        turns = t not in ('f', 'b', 's')
+        if t in ('f', 'b'):
+            speed, dur = s, 0.5
+        elif t in ('lf', 'rf', 'lb', 'rb'):
+            speed, dur = 0.6 * s, 0.5  # The mean of the two wheels, s and s/5
+        elif t in ('l', 'r'):
+            speed, dur = 0., s / 90 if s else float('inf')  # On the spot
+        elif t == 'v':
+            speed, dur, turns = (s[0] + s[1]) / 2, float('inf'), s[0] != s[1]
+        else:
+            speed, dur = 0., 0.
+        if t in ('b', 'lb', 'rb'):
+            speed = -speed
+        self.history.append((now, now + dur, speed, turns))
+
+    # How far (cm) the commands moved the robot forward between times t0 and t1
+    def displacement(self, t0, t1):
+        return sum(speed * max(0., min(end, t1) - max(start, t0))
+                   for start, end, speed, _ in self.history) * self.max_speed
+
+    # Whether a command turned the robot between times t0 and t1
+    def turned(self, t0, t1):
+        return any(turn and end > t0 and start < t1 for start, end, _, turn in self.history)
+
     def operationalize(self):
         t = self.value[0]
         if t in ('l', 'r'):
@@ -18,6 +59,8 @@ class Motob:
             self.turn()
         elif t in ('f', 'b'):
             self.drive()
+        elif t == 'v':
+            self.wheels()
         elif t == 's':
             self.motors.stop()
         else:
@@ -40,6 +83,10 @@ class Motob:
         else:  # r
             self.motors.set_value((s, s/5), 0.5)
 
+    # ('v', (left, right)): wheel speeds in [-1, 1], held until the next command
+    def wheels(self):
+        self.motors.set_value(self.value[1])
+
     def drive(self):
         t = self.value[0]
         s = self.value[1]
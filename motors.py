@@ -1,11 +1,20 @@
 #!/usr/bin/env python
 from time import sleep
+import logging
+import threading
 import RPi.GPIO as GPIO
 import wiringpi as wp
 
+log = logging.getLogger(__name__)
+
 
 class Motors():
-    def __init__(self):
+    # With blocking=False a motion command returns at once, and a timer stops the motors when its duration is
+    # up.  Any newer command cancels the pending stop, so it is never cut short by an older command's timer.
+    def __init__(self, blocking=True):
+        self.blocking = blocking
+        self.stop_timer = None
+        self.lock = threading.RLock()
         self.setup()
 
     def setup(self):
@@ -25,13 +34,14 @@ class Motors():
 
         self.freq = 400  # PWM frequency
         self.dc = 0  # Duty cycle
-        print("Completed setting up motors!")
+        log.info("Completed setting up motors!")
 
     # For the following motion commands, the speed is in the range [-1, 1], indicating the fraction of the maximum
     # speed, with negative values indicating that the wheel will spin in reverse. The argument "dur" (duration)
     # is the time (in seconds) that the action will persist.
 
     def forward(self, speed=0.25, dur=None):
+        self.cancel_stop()
         self.dc = int(self.max * speed)
         self.set_left_dir(0)
         self.set_right_dir(0)
@@ -40,6 +50,7 @@ class Motors():
         self.persist(dur)
 
     def backward(self, speed=0.25, dur=None):
+        self.cancel_stop()
         self.dc = int(self.max * speed)
         self.set_left_dir(1)
         self.set_right_dir(1)
@@ -48,6 +59,7 @@ class Motors():
         self.persist(dur)
 
     def left(self, speed=0.25, dur=None):
+        self.cancel_stop()
         s = int(self.max * speed)
         if self.dc == 0:
             self.set_left_dir(1)
@@ -60,6 +72,7 @@ class Motors():
         self.persist(dur)
 
     def right(self, speed=0.25, dur=None):
+        self.cancel_stop()
         s = int(self.max * speed)
         if self.dc == 0:
             self.set_left_dir(0)
@@ -73,12 +86,14 @@ class Motors():
 
 
     def stop(self):
+        self.cancel_stop()
         self.dc = 0
         self.set_left_speed(self.dc)
         self.set_right_speed(self.dc)
 
     # Val should be a 2-element vector with values for the left and right motor speeds, both in the range [-1, 1].
     def set_value(self, val,dur=None):
+        self.cancel_stop()
         left_val = int(self.max * val[0])
         right_val = int(self.max * val[1])
 
@@ -108,5 +123,22 @@ class Motors():
 
     def persist(self, duration):
         if duration:
-            sleep(duration)
-            self.stop()
+            if self.blocking:
+                sleep(duration)
+                self.stop()
+                return
+            with self.lock:
+                self.stop_timer = threading.Timer(duration, self._deadline_stop)
+                self.stop_timer.daemon = True
+                self.stop_timer.start()
+
+    def cancel_stop(self):
+        with self.lock:
+            if self.stop_timer is not None:
+                self.stop_timer.cancel()
+                self.stop_timer = None
+
+    def _deadline_stop(self):
+        with self.lock:
+            if self.stop_timer is threading.current_thread():
+                self.stop()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# Record what a controller saw and decided on every tick, and replay a recording through a fresh controller in
+# place of the hardware.
+#
+# A recording is a log file of fixed-size records (one per tick) after a JSON header describing them, plus, if a
+# ColorSensob is recorded, a .frames file of fixed-size raw RGB camera frames.  Each record holds the tick and
+# time, then for every sensob a present flag, its raw reading and its derived value, then for every behaviour
+# its active flag and weight, and finally the arbitrated recommendation (command and one or, for a ('v', (left,
+# right)) command, two values) and the halt flag.
+import argparse
+import json
+import math
+import mmap
+import os
+import random
+import struct
+import time
+
+from PIL import Image
+
+from simulation import Simulation, VirtualClock  # First, so the drivers import off the robot
+import behaviour
+from arbitrator import Arbitrator
+from bbcon import BBCON
+from imager2 import Imager
+from sensob import ColorSensob, LineSensob, ProximitySensob
+
+MAGIC = b'ZREC1'
+
+# Struct formats of the raw reading and the derived value of each recordable sensob type.  A ColorSensob's raw
+# reading is the index of its frame in the .frames file.
+SENSOB_FORMATS = {
+    'LineSensob': ('6d', '2b'),
+    'ProximitySensob': ('d', 'd'),
+    'ColorSensob': ('i', '3d'),
+}
+SENSOB_TYPES = {'LineSensob': LineSensob, 'ProximitySensob': ProximitySensob, 'ColorSensob': ColorSensob}
+
+# The keyword arguments a behaviour type takes its sensobs by, in the order of its sensobs + deactivated_sensobs
+BEHAVIOUR_INPUTS = {
+    'CrashPreventionBehaviour': ('proximity',),
+    'GoalBehaviour': ('proximity', 'color'),
+    'LineBehaviour': ('line',),
+    'ExploreBehaviour': (),
+}
+
+
+def _number(v):
+    return math.nan if v is None else v
+
+
+def _optional(v):
+    return None if math.isnan(v) else v
+
+
+def _sensob_type(sensob):
+    for name, cls in SENSOB_TYPES.items():
+        if isinstance(sensob, cls):
+            return name
+    raise ValueError("Cannot record a {}".format(type(sensob).__name__))
+
+
+# The values of a behaviour's settings (see Behaviour.settings), such as LineBehaviour.pid
+def _settings(b):
+    return {name: getattr(b, name) for name in b.settings}
+
+
+# Item counts of a struct format, e.g. 3 for '3d'
+def _items(fmt):
+    return len(struct.unpack('<' + fmt, bytes(struct.calcsize('<' + fmt))))
+
+
+class Recorder:
+    # Observes controller (see BBCON.add_observer) and appends a record to path on every tick.  The sensobs and
+    # behaviours are fixed when the recorder is created.  Camera frames are shrunk by frame_scale before they are
+    # stored.  clock gives the recorded time, which replay hands to the behaviours as time.time().  seed is the
+    # random seed the run was started with, which replay reseeds with, as the behaviours' choices are random.
+    def __init__(self, controller, path, frame_scale=1, clock=time.time, seed=None):
+        self.controller = controller
+        self.clock = clock
+        self.behaviours = list(controller.behaviours)
+        self.sensobs = []
+        for b in self.behaviours:
+            for sensob in b.sensobs + b.deactivated_sensobs:
+                if sensob not in self.sensobs:
+                    self.sensobs.append(sensob)
+        self.frame_size = None
+        for sensob in self.sensobs:
+            if isinstance(sensob, ColorSensob):
+                self.frame_size = (sensob.sensor.img_width // frame_scale, sensob.sensor.img_height // frame_scale)
+        fmt = '<Id'
+        for sensob in self.sensobs:
+            fmt += 'B' + ''.join(SENSOB_FORMATS[_sensob_type(sensob)])
+        fmt += 'Bd' * len(self.behaviours) + '2s2dB'
+        self.record = struct.Struct(fmt)
+        header = {
+            'format': fmt,
+            'frame_size': self.frame_size,
+            'seed': seed,
+            'sensobs': [{'type': _sensob_type(s), 'color': getattr(s, 'color_name', None)} for s in self.sensobs],
+            'behaviours': [{'type': type(b).__name__, 'priority': b.priority,
+                            'inputs': [self.sensobs.index(s) for s in b.sensobs + b.deactivated_sensobs],
+                            'settings': _settings(b)}
+                           for b in self.behaviours],
+        }
+        data = json.dumps(header).encode()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', len(data)) + data)
+        self.frames = open(path + '.frames', 'wb') if self.frame_size else None
+        self.frame_count = 0
+        self.last_frame = (None, -1)  # The latest frame written and its index, stored once for every sensob on it
+        controller.add_observer(self)
+
+    def __call__(self, controller):
+        values = [controller.tick, self.clock()]
+        for sensob in self.sensobs:
+            present = sensob in controller.sensobs and sensob.raw is not None
+            values.append(present)
+            values.extend(self._pack(sensob, present))
+        for b in self.behaviours:
+            values += [b.active, _number(b.weight)]
+        recommendation = controller.arbitrator.recommendation
+        command, value = recommendation if recommendation else ('', None)
+        values += [command.encode()] + (list(value) if command == 'v' else [_number(value), math.nan])
+        values.append(controller.arbitrator.halt)
+        self.file.write(self.record.pack(*values))
+
+    def _pack(self, sensob, present):
+        kind = _sensob_type(sensob)
+        if kind == 'LineSensob':
+            if not present:
+                return [0.] * 6 + [-1, -1]
+            return list(sensob.raw) + [-1 if v is None else v for v in sensob.get_value()]
+        if kind == 'ProximitySensob':
+            return [_number(sensob.raw), _number(sensob.get_value())] if present else [math.nan, math.nan]
+        if not present:
+            return [-1, math.nan, math.nan, math.nan]
+        if sensob.raw is not self.last_frame[0]:
+            image = Imager(image=sensob.raw).get_image()
+            if image.size != self.frame_size:
+                image = image.resize(self.frame_size, Image.NEAREST)
+            self.frames.write(image.convert('RGB').tobytes())
+            self.last_frame = (sensob.raw, self.frame_count)
+            self.frame_count += 1
+        return [self.last_frame[1]] + list(sensob.get_value())
+
+    def close(self):
+        self.controller.remove_observer(self)
+        self.file.close()
+        if self.frames:
+            self.frames.close()
+
+
+class Replay:
+    # A memory-mapped recording.  controller() rebuilds the recorded sensobs and behaviours on top of replayed
+    # sensors, and run() feeds the records through it as fast as it goes.
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a recording: {}".format(path))
+        length = struct.unpack_from('<I', self.data, len(MAGIC))[0]
+        self.offset = len(MAGIC) + 4 + length
+        self.header = json.loads(self.data[len(MAGIC) + 4:self.offset].decode())
+        self.record = struct.Struct(self.header['format'])
+        self.count = (len(self.data) - self.offset) // self.record.size
+        self.frame_size = self.header['frame_size']
+        self.frames = None
+        if self.frame_size:
+            with open(path + '.frames', 'rb') as f:
+                # An empty file (the camera never ran) cannot be mapped
+                if os.fstat(f.fileno()).st_size:
+                    self.frames = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Where each sensob's fields start in a record: present flag, raw reading, derived value
+        self.fields = []
+        i = 2
+        for sensob in self.header['sensobs']:
+            raw, derived = SENSOB_FORMATS[sensob['type']]
+            self.fields.append((i, i + 1 + _items(raw), i + 1 + _items(raw) + _items(derived)))
+            i = self.fields[-1][2]
+        self.behaviour_fields = i
+        self.position = 0
+        self.clock = VirtualClock()
+
+    def __len__(self):
+        return self.count
+
+    def values(self, i):
+        return self.record.unpack_from(self.data, self.offset + i * self.record.size)
+
+    def time(self, i):
+        return self.values(i)[1]
+
+    # The recorded (command, value) recommendation of record i, or None.  Recordings made before wheel speed
+    # commands have one value.
+    def recommendation(self, i):
+        values = self.values(i)
+        if self.header['format'].endswith('2sdB'):
+            command, value, right = values[-3], values[-2], math.nan
+        else:
+            command, value, right = values[-4:-1]
+        command = command.rstrip(b'\0').decode()
+        if not command:
+            return None
+        return (command, (value, right)) if command == 'v' else (command, _optional(value))
+
+    # The raw reading of sensob index at record i, or None if it was not polled then
+    def raw(self, index, i):
+        values = self.values(i)
+        start, derived, _ = self.fields[index]
+        if not values[start]:
+            return None
+        raw = values[start + 1:derived]
+        kind = self.header['sensobs'][index]['type']
+        if kind == 'LineSensob':
+            return list(raw)
+        if kind == 'ProximitySensob':
+            return _optional(raw[0])
+        size = self.frame_size[0] * self.frame_size[1] * 3
+        return Image.frombytes('RGB', tuple(self.frame_size), self.frames[raw[0] * size:(raw[0] + 1) * size])
+
+    def sensor(self, index):
+        return ReplaySensor(self, index)
+
+    def sensobs(self):
+        made = []
+        for index, sensob in enumerate(self.header['sensobs']):
+            if sensob['type'] == 'ColorSensob':
+                made.append(ColorSensob(sensob['color'], sensor=self.sensor(index)))
+            else:
+                made.append(SENSOB_TYPES[sensob['type']](sensor=self.sensor(index)))
+        return made
+
+    # A controller with the recorded behaviours, priorities and sensob wiring.  overrides maps behaviour indices
+    # to dicts of attributes to set on them (e.g. {2: {'trigger': 15}}).
+    def controller(self, overrides=None):
+        sensobs = self.sensobs()
+        bbcon = BBCON(arbitrator=Arbitrator())
+        bbcon.add_motob(ReplayMotob())
+        for index, recorded in enumerate(self.header['behaviours']):
+            inputs = {name: sensobs[i] for name, i in zip(BEHAVIOUR_INPUTS[recorded['type']], recorded['inputs'])}
+            b = getattr(behaviour, recorded['type'])(priority=recorded['priority'], **inputs)
+            settings = dict(recorded.get('settings', {}), **(overrides or {}).get(index, {}))
+            for name, value in settings.items():
+                setattr(b, name, value)
+            bbcon.add_behaviour(b)
+        return bbcon
+
+    # Run the recording through controller (by default controller()), with the behaviours' time.time() giving
+    # the recorded times for the duration, after seeding random with seed (by default the recorded one, if any).
+    # Returns the tick count, how many recommendations differ from the recorded ones, and the wall time taken.
+    def run(self, controller=None, seed=None):
+        controller = controller if controller is not None else self.controller()
+        seed = seed if seed is not None else self.header.get('seed')
+        if seed is not None:
+            random.seed(seed)
+        original, behaviour.time = behaviour.time, self.clock
+        mismatches = 0
+        start = time.perf_counter()
+        ticks = 0
+        try:
+            for i in range(self.count):
+                self.position = i
+                self.clock.now = self.time(i)
+                halt = controller.run_one_timestep()
+                ticks += 1
+                if controller.arbitrator.recommendation != self.recommendation(i):
+                    mismatches += 1
+                if halt:
+                    break
+        finally:
+            behaviour.time = original
+        elapsed = time.perf_counter() - start
+        return {'ticks': ticks, 'mismatches': mismatches, 'seconds': elapsed,
+                'ticks_per_second': ticks / elapsed if elapsed else 0.}
+
+
+class ReplaySensor:
+    # Stands in for a sensor driver, returning what the recorded sensob read at the replay position.  When the
+    # sensob was not polled at that record, the latest earlier reading is used.  Only the records since the
+    # previous update are searched for it, unless the position moved back.
+    def __init__(self, replay, index):
+        self.replay = replay
+        self.index = index
+        self.value = None
+        self.latest = None  # The latest reading up to record checked
+        self.checked = -1
+
+    def get_value(self):
+        return self.value
+
+    def update(self):
+        position = self.replay.position
+        if position < self.checked:
+            self.latest, self.checked = None, -1
+        for i in range(position, self.checked, -1):
+            raw = self.replay.raw(self.index, i)
+            if raw is not None:
+                self.latest = raw
+                break
+        self.checked = position
+        self.value = self.latest
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class ReplayMotob:
+    # Takes the controller's commands without driving anything
+    def __init__(self):
+        self.value = None
+
+    def update(self, v):
+        self.value = v
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record a simulated run, or replay a recording")
+    sub = parser.add_subparsers(dest='command', required=True)
+    record = sub.add_parser('record')
+    record.add_argument('path')
+    record.add_argument('--config', default='full')
+    record.add_argument('--ticks', type=int, default=1000)
+    record.add_argument('--frame-scale', type=int, default=1)
+    record.add_argument('--seed', type=int, default=0)
+    replay = sub.add_parser('replay')
+    replay.add_argument('path')
+    args = parser.parse_args()
+    if args.command == 'record':
+        random.seed(args.seed)
+        with Simulation() as sim:
+            bbcon = sim.controller(args.config)
+            recorder = Recorder(bbcon, args.path, frame_scale=args.frame_scale, clock=sim.clock.time, seed=args.seed)
+            sim.scheduler().run(bbcon, max_ticks=args.ticks)
+            recorder.close()
+        print("Recorded {} ticks to {}".format(bbcon.tick, args.path))
+    else:
+        print(Replay(args.path).run())
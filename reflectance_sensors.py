@@ -1,29 +1,57 @@
 #!/usr/bin/env python
-from time import sleep
+from time import sleep, monotonic, monotonic_ns, time as timestamp
 import datetime
+import json
+import logging
+import os
+import threading
 import RPi.GPIO as GPIO
 
+log = logging.getLogger(__name__)
+
+# Where bbcon.py keeps the calibration between runs
+PROFILE = os.path.join(os.path.expanduser('~'), '.zumo', 'reflectance.json')
+
 
 class ReflectanceSensors:
     # The constructor allows students to decide if they want to auto_calibrate
     # the robot, or if they want to hard code the min and max readings of the
-    # reflectance sensors
-    def __init__(self, auto_calibrate=False, min_reading=100, max_reading=1000):
+    # reflectance sensors.
+    # With parallel=True all six pins are polled in one loop, so a read takes as long as the slowest decay
+    # instead of the sum of them.  The wait is capped at max_decay_us (by default the largest calibrated range,
+    # beyond which normalize saturates anyway); calibration waits at most calibration_timeout_us.
+    # With a profile (a file path), auto calibration loads the min and max readings saved there by an earlier
+    # run, unless they are older than max_profile_age seconds, and saves them there after calibrating.  With
+    # refine=True (parallel reads only) readings outside the calibrated range widen it while driving, and the
+    # profile is rewritten in the background at most every save_interval seconds; reads then wait up to
+    # calibration_timeout_us over surfaces darker than calibrated.
+    def __init__(self, auto_calibrate=False, min_reading=100, max_reading=1000, parallel=True, max_decay_us=None,
+                 calibration_timeout_us=3000, profile=None, max_profile_age=24 * 3600, refine=False,
+                 save_interval=60):
+        self.parallel = parallel
+        self.max_decay_us = max_decay_us
+        self.calibration_timeout_us = calibration_timeout_us
+        self.profile = profile
+        self.max_profile_age = max_profile_age
+        self.refine = refine
+        self.save_interval = save_interval
+        self.last_save = None
+        self.saver = None
         self.setup()
         if (auto_calibrate):
-            # Calibration loop should last ~5 seconds
-            # Calibrates all sensors
-            for i in range(5):
-                self.calibrate()
-                sleep(1)
+            if not self.load_profile():
+                # Calibration loop should last ~5 seconds
+                # Calibrates all sensors
+                for i in range(5):
+                    self.calibrate()
+                    sleep(1)
+                self.save_profile()
         else:
             for i in range(len(self.max_val)):
                 self.max_val[i] = max_reading
                 self.min_val[i] = min_reading
 
-        print("Calibration results")
-        print(self.max_val)
-        print(self.min_val)
+        log.info("Calibration results: max %s, min %s", self.max_val, self.min_val)
 
     def setup(self):
         # Initialize class variables
@@ -44,7 +72,16 @@ class ReflectanceSensors:
         GPIO.setmode(GPIO.BOARD)
 
     def calibrate(self):
-        print("calibrating...")
+        log.debug("calibrating...")
+        if self.parallel:
+            times = self.read_decay_times(self.calibration_timeout_us)
+            for index, t in enumerate(times):
+                if self.max_val[index] == -1 or t > self.max_val[index]:
+                    self.max_val[index] = t
+                if self.min_val[index] == -1 or t < self.min_val[index]:
+                    self.min_val[index] = t
+            log.debug("Decay times: %s", times)
+            return
         self.recharge_capacitors()
 
         # GPIO.setup(sensor_inputs, GPIO.IN)
@@ -66,8 +103,63 @@ class ReflectanceSensors:
                     self.min_val[index] = time.microseconds
 
             # Print the calculated time in microseconds
-            print("Pin: " + str(pin))
-            print(time.microseconds)
+            log.debug("Pin: %s %s", pin, time.microseconds)
+
+    # Take max_val and min_val from the profile if it is there, recent and sane.  Returns whether it was used.
+    def load_profile(self):
+        if self.profile is None:
+            return False
+        try:
+            with open(self.profile) as f:
+                saved = json.load(f)
+            max_val, min_val, age = list(saved['max_val']), list(saved['min_val']), timestamp() - saved['time']
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            log.info("No calibration profile in %s: %s", self.profile, ex)
+            return False
+        if not 0 <= age < self.max_profile_age:
+            log.info("Calibration profile %s is %.0f s old, recalibrating", self.profile, age)
+            return False
+        if len(max_val) != len(self.max_val) or len(min_val) != len(self.min_val) or any(
+                hi <= lo for hi, lo in zip(max_val, min_val)):
+            log.info("Calibration profile %s does not fit these sensors, recalibrating", self.profile)
+            return False
+        self.max_val, self.min_val = max_val, min_val
+        log.info("Loaded calibration profile %s (%.0f s old)", self.profile, age)
+        return True
+
+    # Write the calibration to the profile, replacing the old file only once the new one is complete
+    def save_profile(self, max_val=None, min_val=None):
+        if self.profile is None:
+            return
+        saved = {'time': timestamp(), 'max_val': list(max_val or self.max_val),
+                 'min_val': list(min_val or self.min_val)}
+        try:
+            os.makedirs(os.path.dirname(self.profile) or '.', exist_ok=True)
+            with open(self.profile + '.tmp', 'w') as f:
+                json.dump(saved, f)
+            os.replace(self.profile + '.tmp', self.profile)
+        except OSError as ex:
+            log.warning("Could not save calibration profile %s: %s", self.profile, ex)
+        self.last_save = monotonic()
+
+    # Widen the calibrated range with decay times read while driving.  Times at the timeout say nothing about
+    # the maximum, since the sensor had not decayed yet.
+    def refine_calibration(self, times, timeout_us):
+        changed = False
+        for index, t in enumerate(times):
+            if t < self.min_val[index]:
+                self.min_val[index] = t
+                changed = True
+            elif self.max_val[index] < t < timeout_us:
+                self.max_val[index] = t
+                changed = True
+        if changed and self.profile is not None and (self.saver is None or not self.saver.is_alive()) and (
+                self.last_save is None or monotonic() - self.last_save >= self.save_interval):
+            log.debug("Refined calibration: max %s, min %s", self.max_val, self.min_val)
+            self.last_save = monotonic()
+            self.saver = threading.Thread(target=self.save_profile, args=(list(self.max_val), list(self.min_val)),
+                                          daemon=True)
+            self.saver.start()
 
     def get_sensor_reading(self, pin):
         GPIO.setup(pin, GPIO.IN)
@@ -84,6 +176,32 @@ class ReflectanceSensors:
         return time
 
 
+    # Decay time in microseconds of every sensor, by index, measured together after one recharge.  Sensors
+    # still high after timeout_us read as timeout_us.
+    def read_decay_times(self, timeout_us):
+        self.recharge_capacitors()
+        GPIO.setup(self.sensor_inputs, GPIO.IN)
+        times = [timeout_us] * len(self.sensor_inputs)
+        pending = self.sensor_inputs
+        start = monotonic_ns()
+        deadline = start + timeout_us * 1000
+        now = start
+        while pending and now < deadline:
+            now = monotonic_ns()
+            still_high = []
+            for pin in pending:
+                if GPIO.input(pin):
+                    still_high.append(pin)
+                else:
+                    times[self.sensor_indices[pin]] = (now - start) // 1000
+            pending = still_high
+        return times
+
+    def decay_timeout_us(self):
+        if self.max_decay_us is not None:
+            return self.max_decay_us
+        return max(hi - lo for hi, lo in zip(self.max_val, self.min_val))
+
     def recharge_capacitors(self):
         # Make all sensors an output, and set all to HIGH
         GPIO.setup(self.sensor_inputs, GPIO.OUT)
@@ -111,6 +229,14 @@ class ReflectanceSensors:
 
 
     def compute_value(self):
+        if self.parallel:
+            # Refining needs to see decays beyond the calibrated range, so it waits as long as calibration does
+            timeout_us = self.calibration_timeout_us if self.refine else self.decay_timeout_us()
+            times = self.read_decay_times(timeout_us)
+            if self.refine:
+                self.refine_calibration(times, timeout_us)
+            self.value = [1 - self.normalize(index, t) for index, t in enumerate(times)]
+            return
         self.recharge_capacitors()
         for pin in self.sensor_inputs:
             time = self.get_sensor_reading(pin)
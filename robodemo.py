@@ -2,6 +2,7 @@ __author__ = 'keithd'
 
 from time import sleep
 import random
+from PIL import Image
 import imager2 as IMR
 from reflectance_sensors import ReflectanceSensors
 from camera import Camera
@@ -70,11 +71,40 @@ def tourist(steps=25,shots=5,speed=.25):
             im = shoot_panorama(c,m,shots)
             im.dump_image('vacation_pic'+str(i)+'.jpeg')
 
+
+# Frames pasted side by side into a canvas that is allocated once, when the first frame shows its size, so
+# building a panorama of n shots copies each frame once rather than the whole panorama n times.
+class Panorama():
+    def __init__(self,shots,background='black'):
+        self.shots = shots
+        self.background = background
+        self.image = None
+        self.count = 0
+
+    def add(self,frame):
+        if not isinstance(frame,Image.Image):
+            frame = Image.fromarray(frame)  # A raw camera frame
+        if self.image is None:
+            self.width, self.height = frame.size
+            color = IMR.Imager._pixel_colors_[self.background]
+            self.image = Image.new('RGB',(self.width*self.shots,self.height),color)
+        self.image.paste(frame,(self.count*self.width,0))
+        self.count += 1
+
+    def get_imager(self):
+        return IMR.Imager(image=self.image)
+
+# Each capture is started before the turn that precedes it, with its delay set to end after the turn, so the
+# camera starts up while the robot rotates and the last frame is pasted in meanwhile.
 def shoot_panorama(camera,motors,shots=5):
-    s = 1
-    im = IMR.Imager(image=camera.update()).scale(s,s)
+    panorama = Panorama(shots)
+    frame = camera.update()
     rotation_time = 3/shots # At a speed of 0.5(of max), it takes about 3 seconds to rotate 360 degrees
+    settle = 0.1 # Let the robot come to rest before the picture is taken
     for i in range(shots-1):
+        capture = camera.begin_capture(delay=rotation_time+settle)
+        panorama.add(frame)
         motors.right(0.5,rotation_time)
-        im = im.concat_horiz(IMR.Imager(image=camera.update()))
-    return im
+        frame = camera.finish_capture(capture)
+    panorama.add(frame)
+    return panorama.get_imager()
@@ -0,0 +1,58 @@
+from collections import deque
+import time
+
+
+class Scheduler:
+    # Runs a controller's run_one_timestep at a fixed rate (Hz), sleeping only for what is left of each period.
+    # When every behaviour bidding for the motors (active, with a weight above 0) is low_cost, idle_rate is used
+    # instead.  clock and sleep can be replaced, e.g. by a virtual clock in simulation.
+    def __init__(self, rate=10, idle_rate=None, history=1000, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.idle_rate = idle_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.ticks = 0
+        self.missed = 0  # Ticks that ran past the end of their period
+        self.durations = deque(maxlen=history)  # Seconds spent in run_one_timestep
+        self.jitter = deque(maxlen=history)  # Seconds between when a tick should and did start
+        self.deadline = None
+
+    def period(self, controller):
+        bidding = [b for b in controller.active_behaviours() if b.weight]
+        if self.idle_rate and bidding and all(b.low_cost for b in bidding):
+            return 1 / self.idle_rate
+        return 1 / self.rate
+
+    # Run one tick and wait for the start of the next period. Returns True if the controller halted.
+    def step(self, controller):
+        start = self.clock()
+        if self.deadline is not None:
+            self.jitter.append(max(0., start - self.deadline))
+        halt = controller.run_one_timestep()
+        end = self.clock()
+        self.ticks += 1
+        self.durations.append(end - start)
+        self.deadline = (self.deadline if self.deadline is not None else start) + self.period(controller)
+        if end > self.deadline:
+            self.missed += 1
+            self.deadline = end  # Start the next tick now rather than trying to catch up
+        elif not halt:
+            self.sleep(self.deadline - end)
+        return halt
+
+    def run(self, controller, max_ticks=None):
+        while max_ticks is None or self.ticks < max_ticks:
+            if self.step(controller):
+                return True
+        return False
+
+    def summary(self):
+        durations = sorted(self.durations)
+        return {
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'mean_duration': sum(durations) / len(durations) if durations else 0.,
+            'max_duration': durations[-1] if durations else 0.,
+            'mean_jitter': sum(self.jitter) / len(self.jitter) if self.jitter else 0.,
+            'max_jitter': max(self.jitter) if self.jitter else 0.,
+        }
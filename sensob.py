@@ -1,41 +1,150 @@
-from reflectance_sensors import ReflectanceSensors
-from camera import Camera
-from imager2 import Imager
-from ultrasonic import Ultrasonic
+from collections import deque
+from copy import copy
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
 
 
 class Sensob:
-    def __init__(self, sensor):
-        self.sensor = sensor  # No usecase for multiple sensors
+    # The sensor reading and the value derived from it are cached until invalidate() is called, which the
+    # controller does once per tick, so repeated get_value calls and sensobs shared by several behaviours
+    # cost nothing.  With max_age (seconds) a reading is kept across ticks until it is that old.  Without a sensor,
+    # the default driver (see make_sensor) is only built, and its module imported, when the sensor is first used.
+    def __init__(self, sensor=None, max_age=None):
+        self._sensor = sensor  # No usecase for multiple sensors
+        self.max_age = max_age
+        self.raw = None  # Cached sensor reading
+        self.timestamp = None  # When raw was read
+        self.value = None  # Cached derived value
+        self.has_value = False
+        self.version = 0  # Incremented whenever the derived value changes
+        # Background sampling (see start_sampling): the worker thread and its latest (reading, time) slot
+        self.sampler = None
+        self.stopped = None  # The last sampler stopped, which may still be finishing a read
+        self.sample_ready = threading.Condition()
+        self.sample = None
+
+    @property
+    def sensor(self):
+        if self._sensor is None:
+            self._sensor = self.make_sensor()
+        return self._sensor
+
+    @sensor.setter
+    def sensor(self, sensor):
+        self._sensor = sensor
+
+    # The driver used when none is given
+    def make_sensor(self):
+        raise ValueError("{} needs a sensor".format(type(self).__name__))
 
     def update(self):
-        if self.sensor.get_value() is None:
-            self.sensor.update()
+        if self.raw is None:
+            self.read()
         return self.get_value()
 
+    # Take a new reading, from the sampling thread if there is one, or else from the sensor
+    def read(self):
+        if self.sampler is not None:
+            self.raw, self.timestamp = self.latch()
+        else:
+            self.sensor.update()
+            self.raw, self.timestamp = self.sensor.get_value(), time.monotonic()
+        self.has_value = False
+
     def get_value(self):
-        return self.sensor.get_value()
+        if not self.has_value:
+            value = self.derive(self.reading())
+            if value != self.value:
+                self.version += 1
+            self.value = value
+            self.has_value = True
+        return self.value
+
+    # The value this sensob reports for a sensor reading
+    def derive(self, reading):
+        return reading
+
+    # The raw sensor reading the derived value is computed from
+    def reading(self):
+        if self.raw is None:
+            self.read()
+        return self.raw
+
+    # Drop the cached reading, unless it is younger than max_age
+    def invalidate(self):
+        if self.max_age is None or self.timestamp is None or time.monotonic() - self.timestamp >= self.max_age:
+            self.reset()
 
     def reset(self):
-        self.sensor.reset()
+        self.raw = None
+        self.has_value = False
+
+    # Read the sensor continuously in a worker thread, so update() only picks up the latest reading instead of
+    # waiting for the hardware.  period is the minimum time between two reads.
+    def start_sampling(self, period=0.01):
+        if self.sampler is None:
+            self.sampler = threading.Thread(target=self._sample_loop, args=(period, self.stopped), daemon=True)
+            self.sampler.start()
 
+    # Stopping does not wait for the sampler, which may be in the middle of a slow read (a camera capture) and
+    # would hold up the tick that stops it: the sampler quits after that read and discards it.
+    def stop_sampling(self):
+        if self.sampler is not None:
+            self.stopped, self.sampler = self.sampler, None
+        with self.sample_ready:
+            self.sample = None
 
+    # The newest (reading, time) sample.  Blocks only until the first sample exists.
+    def latch(self):
+        sampler = self.sampler
+        with self.sample_ready:
+            self.sample_ready.wait_for(lambda: self.sample is not None or not sampler.is_alive())
+            if self.sample is None:
+                raise IOError("Sampling thread of {} stopped without a reading".format(type(self).__name__))
+            return self.sample
+
+    # A sampler started soon after another stopped first lets that one finish its read, so the two never read
+    # the sensor at once
+    def _sample_loop(self, period, previous):
+        thread = threading.current_thread()
+        if previous is not None:
+            previous.join()
+        try:
+            while self.sampler is thread:
+                start = time.monotonic()
+                self.sensor.update()
+                sample = (copy(self.sensor.get_value()), time.monotonic())
+                self.sensor.reset()
+                with self.sample_ready:
+                    if self.sampler is not thread:
+                        break
+                    self.sample = sample
+                    self.sample_ready.notify_all()
+                time.sleep(max(0., period - (time.monotonic() - start)))
+        finally:
+            with self.sample_ready:
+                self.sample_ready.notify_all()
+
+
+# The sensor argument of the sensobs below replaces the default driver, e.g. with a simulated one.
 class LineSensob(Sensob):
-    def __init__(self):
-        super(LineSensob, self).__init__(ReflectanceSensors(auto_calibrate=True))
+    def __init__(self, sensor=None, max_age=None):
+        super(LineSensob, self).__init__(sensor, max_age)
         self.sensor_count = 6
+        self.noise = 0.2  # Darkness of a reading that is still taken as floor
 
-    def update(self):
-        if self.sensor.get_value() == [-1.0] * self.sensor_count:
-            self.sensor.update()
-        return self.get_value()
+    def make_sensor(self):
+        from reflectance_sensors import ReflectanceSensors
+        return ReflectanceSensors(auto_calibrate=True)
 
     # Return a tuple representing at which sensor the line starts/ends
-    def get_value(self):
+    def derive(self, val):
+        log.debug("Reflectance %s", val)
         min_, max_ = None, None
-        val = self.sensor.get_value()
         for i, v in enumerate(val):
-            print(v)
             if min_ is None:
                 if v <= 0.5:
                     min_ = i
@@ -47,44 +156,209 @@ class LineSensob(Sensob):
             max_ = self.sensor_count - 1
         return min_, max_
 
+    # Where the line is, in sensors from the leftmost one (0 to sensor_count - 1), as the mean sensor index
+    # weighted by how dark each reading is, or None when all together are less dark than one reading derive takes
+    # as line.  Shades of grey between two sensors put it between them, far finer than derive.
+    def position(self):
+        weights = [max(0., 1. - v - self.noise) for v in self.reading()]
+        total = sum(weights)
+        if total < 0.5 - self.noise:
+            return None
+        return sum(i * w for i, w in enumerate(weights)) / total
+
 
 class ColorSensob(Sensob):
-    def __init__(self, color):
-        super(ColorSensob, self).__init__(Camera())
-        self.imager = Imager()
+    # With source (a ColorsSensob) the frame and the colour analysis are the source's, shared with every other
+    # ColorSensob on it, instead of each sensob taking and analysing its own picture.
+    def __init__(self, color, sensor=None, max_age=None, source=None):
+        super(ColorSensob, self).__init__(sensor, max_age)
+        self.source = source
+        self.sampling_source = False
         self.color = None
+        self.color_name = None
         self.set_color(color)
 
+    def make_sensor(self):
+        if self.source is not None:
+            return self.source.sensor
+        from camera import Camera
+        return Camera()
+
     def set_color(self, color):
+        from imager2 import Imager
         try:
-            self.color = Imager().get_color_rgb(color)
+            self.color = Imager._pixel_colors_[color]
         except KeyError as ex:
             raise ValueError("Invalid color name") from ex
+        if self.source is not None and color not in self.source.colors:
+            raise ValueError("{} is not one of the source's colors".format(color))
+        self.color_name = color
+        self.has_value = False
 
-    def get_value(self):
+    def read(self):
+        if self.source is None:
+            return super(ColorSensob, self).read()
+        self.source.update()
+        self.raw, self.timestamp = self.source.raw, self.source.timestamp
+        self.has_value = False
+
+    def derive(self, reading):
+        if self.source is not None:
+            return self.source.get_value()[self.color_name]
+        from imager2 import Imager
         # TODO: Support white/black
-        imager = Imager(image=self.sensor.get_value()).map_color_wta()
-        left = 0
-        middle = 0
-        right = 0
-        for x in range(int(imager.xmax * 0.4)):
-            for y in range(imager.ymax):
-                if imager.get_pixel(x, y) == self.color:
-                    left += 1
-        for x in range(int(imager.xmax * 0.4), int(imager.xmax * 0.6)):
-            for y in range(imager.ymax):
-                if imager.get_pixel(x, y) == self.color:
-                    middle += 1
-        for x in range(int(imager.xmax * 0.6), imager.xmax):
-            for y in range(imager.ymax):
-                if imager.get_pixel(x, y) == self.color:
-                    right += 1
-        left /= (imager.xmax * imager.ymax) * 0.4  # Normalize
-        middle /= (imager.xmax * imager.ymax) * 0.2  # Normalize
-        right /= (imager.xmax * imager.ymax) * 0.4  # Normalize
-        return left, middle, right
+        return Imager(image=reading).color_bands(self.color)
+
+    def invalidate(self):
+        super(ColorSensob, self).invalidate()
+        if self.source is not None:
+            self.source.invalidate()
+
+    def start_sampling(self, period=0.01):
+        if self.source is None:
+            return super(ColorSensob, self).start_sampling(period)
+        if not self.sampling_source:
+            self.sampling_source = True
+            self.source.start_sampling(period)
+
+    def stop_sampling(self):
+        if self.source is None:
+            return super(ColorSensob, self).stop_sampling()
+        if self.sampling_source:
+            self.sampling_source = False
+            self.source.stop_sampling()
+
+
+class ColorsSensob(Sensob):
+    # The left/middle/right fractions of several colours at once, as {colour: (left, middle, right)}, from one
+    # frame and one pass of a ColorClassifier (by default the WTA rule that ColorSensob uses, on the top 6 bits of
+    # R, G and B, so the fractions can differ from ColorSensob's by up to about 0.02).  Give it to
+    # ColorSensobs as their source to let several GoalBehaviours share one camera.
+    def __init__(self, colors=('red', 'green', 'blue'), sensor=None, max_age=None, classifier=None):
+        super(ColorsSensob, self).__init__(sensor, max_age)
+        self.colors = list(colors)
+        self.classifier = classifier  # Built on first use if not given
+        self.samplers = 0  # ColorSensobs that asked for sampling
+
+    def make_sensor(self):
+        from camera import Camera
+        return Camera()
+
+    def derive(self, reading):
+        from imager2 import ColorClassifier, Imager, np
+        if self.classifier is None and np is not None:
+            self.classifier = ColorClassifier(self.colors)
+        if self.classifier is None:
+            imager = Imager(image=reading)
+            return {color: imager.color_bands(imager.get_color_rgb(color)) for color in self.colors}
+        return self.classifier.bands(reading)
+
+    def color(self, color):
+        return ColorSensob(color, source=self)
+
+    # Sampling runs while any ColorSensob on this one wants it
+    def start_sampling(self, period=0.01):
+        self.samplers += 1
+        super(ColorsSensob, self).start_sampling(period)
+
+    def stop_sampling(self):
+        self.samplers = max(0, self.samplers - 1)
+        if not self.samplers:
+            super(ColorsSensob, self).stop_sampling()
 
 
+# Distance ahead in cm, from an ultrasonic sensor timing its echoes in the background (see Ultrasonic), or None
+# when the sensor has stopped answering
 class ProximitySensob(Sensob):
-    def __init__(self):
-        super(ProximitySensob, self).__init__(Ultrasonic())
+    def __init__(self, sensor=None, max_age=None):
+        super(ProximitySensob, self).__init__(sensor, max_age)
+
+    def make_sensor(self):
+        from ultrasonic import Ultrasonic
+        return Ultrasonic(interrupts=True)
+
+
+class FilteredProximitySensob(ProximitySensob):
+    # A distance estimate predicted for the moment it is asked for, so behaviours get a fresh value every tick
+    # while the sensor pings far less often.  Echoes are motion compensated with the forward movement motob was
+    # commanded to make and their median over the last burst rejects outliers.  An alpha-beta filter then
+    # tracks the distance and how fast the obstacle itself approaches, and predicts between pings.  After a turn the
+    # estimate restarts from the median, and the sensor is pinged on every tick while the robot turns.  Lost echoes
+    # (no distance, or zero) are dropped, readings beyond max_range count as max_range, and max_range is also
+    # the value until the first valid echo.  The sensor is pinged every max_period seconds when nothing is within
+    # far cm, down to every min_period as obstacles close in.  clock must be the one motob and the sensor's echo
+    # times use.
+    def __init__(self, motob=None, sensor=None, burst=3, max_range=400., min_period=0.06, max_period=0.5, far=100.,
+                 clock=time.monotonic):
+        super(FilteredProximitySensob, self).__init__(sensor)
+        self.motob = motob
+        self.clock = clock
+        self.max_range = max_range
+        self.min_period = min_period
+        self.max_period = max_period
+        self.far = far
+        self.alpha = 0.6
+        self.beta = 0.1
+        self.echoes = deque(maxlen=burst)  # (time, distance) of the latest valid echoes
+        self.estimate = None  # (time, distance, approach speed of the obstacle in cm/s)
+        self.last_echo = None  # Time of the latest reading taken, valid or not
+        self.pings = 0
+
+    # How far the robot was commanded to move forward between times t0 and t1
+    def moved(self, t0, t1):
+        return self.motob.displacement(t0, t1) if self.motob is not None else 0.
+
+    # Whether the sensor may be facing something else than at time t0
+    def turned(self, t0, t1):
+        return self.motob is not None and self.motob.turned(t0, t1)
+
+    def predict(self, t):
+        t0, distance, speed = self.estimate
+        return min(self.max_range, max(0., distance - self.moved(t0, t) - speed * (t - t0)))
+
+    # Seconds between pings, growing with the estimated distance
+    def period(self):
+        if self.estimate is None:
+            return self.min_period
+        near = min(1., self.predict(self.clock()) / self.far)
+        return self.min_period + (self.max_period - self.min_period) * near
+
+    def add_echo(self, t, distance):
+        self.last_echo = t
+        self.pings += 1
+        if not distance or distance < 0:
+            return
+        self.echoes.append((t, min(distance, self.max_range)))
+        measured = sorted(d - self.moved(te, t) for te, d in self.echoes)[(len(self.echoes) - 1) // 2]
+        if self.estimate is None or self.turned(self.estimate[0], t):
+            self.estimate = (t, measured, 0.)
+            return
+        t0, _, speed = self.estimate
+        predicted = self.predict(t)
+        residual = measured - predicted
+        if t > t0:
+            speed -= self.beta * residual / (t - t0)
+        self.estimate = (t, predicted + self.alpha * residual, speed)
+
+    def read(self):
+        now = self.clock()
+        if self.sampler is not None:
+            reading, t = self.latch()
+            if self.last_echo is None or t > self.last_echo:
+                self.add_echo(t, reading)
+        elif getattr(self.sensor, 'interrupts', False):
+            if self.estimate is None:
+                self.sensor.update()  # Waits for the first echo
+            with self.sensor.reading_ready:
+                readings = list(self.sensor.readings)
+            for t, reading in readings:
+                if self.last_echo is None or t > self.last_echo:
+                    self.add_echo(t, reading)
+            self.sensor.ping_interval = self.period()
+        elif self.last_echo is None or now - self.last_echo >= self.period() or self.turned(self.last_echo, now):
+            self.sensor.update()
+            now = self.clock()
+            self.add_echo(now, self.sensor.get_value())
+        self.raw = self.predict(now) if self.estimate is not None else self.max_range
+        self.timestamp = now
+        self.has_value = False
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# Simulated Zumo: a 2D world with a line track, obstacles and coloured goals, simulated drivers that read from it,
+# and a virtual clock, so BBCON and the behaviours run unchanged and faster than real time off the robot.
+from heapq import heappop, heappush
+from itertools import count
+import math
+import random
+
+try:
+    import RPi.GPIO
+    import wiringpi
+except ImportError:
+    from fake_hardware import install_fake_hardware
+    install_fake_hardware()
+
+import behaviour
+import motors
+import reflectance_sensors
+import ultrasonic
+from arbitrator import Arbitrator
+from bbcon import BBCON
+from behaviour import CrashPreventionBehaviour, ExploreBehaviour, GoalBehaviour, LineBehaviour
+from camera import Camera
+from irproximity_sensor import IRProximitySensor
+from motob import Motob
+from motors import Motors
+from reflectance_sensors import ReflectanceSensors
+from scheduler import Scheduler
+from sensob import ColorSensob, ColorsSensob, FilteredProximitySensob, LineSensob, ProximitySensob
+from ultrasonic import Ultrasonic
+from zumo_button import ZumoButton
+
+
+class VirtualClock:
+    # Stands in for the time module: sleep() advances the clock at once, running any timers that fall due
+    # and telling the listeners (e.g. World.step) how much time passed.
+    def __init__(self, start=0.):
+        self.now = start
+        self.listeners = []
+        self.timers = []
+        self.sequence = count()
+
+    def time(self):
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        end = self.now + max(0., seconds)
+        while self.timers and self.timers[0][0] <= end:
+            deadline, _, timer = heappop(self.timers)
+            self._move_to(deadline)
+            if timer[0] is not None:
+                timer[0]()
+        self._move_to(end)
+
+    # Returns a handle for cancel()
+    def call_later(self, delay, func):
+        timer = [func]
+        heappush(self.timers, (self.now + delay, next(self.sequence), timer))
+        return timer
+
+    def cancel(self, timer):
+        timer[0] = None
+
+    def _move_to(self, t):
+        dt = t - self.now
+        self.now = t
+        if dt > 0:
+            for listener in self.listeners:
+                listener(dt)
+
+
+class Obstacle:
+    # A cylinder; coloured ones are goals the camera can see
+    def __init__(self, x, y, radius, color=None, height=10.):
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.color = color
+        self.height = height
+
+    # Distance along the ray from (x, y) in direction (dx, dy) to the surface, or None if it misses
+    def hit(self, x, y, dx, dy):
+        ox, oy = self.x - x, self.y - y
+        along = ox * dx + oy * dy
+        across2 = ox * ox + oy * oy - along * along
+        if along <= 0 or across2 > self.radius ** 2:
+            return None
+        return along - math.sqrt(self.radius ** 2 - across2)
+
+
+class World:
+    # Lengths are in cm, angles in radians, headings counter-clockwise from the x axis.  line is a list of
+    # polylines ((x, y) points) of dark tape on a light floor; obstacles are Obstacle instances.
+    max_speed = 50.  # Wheel speed in cm/s at full duty cycle
+    wheel_base = 9.
+    robot_radius = 5.
+    line_width = 2.
+    sensor_offset = 4.  # Reflectance array: distance ahead of the axle and spacing of the six sensors
+    sensor_spacing = 1.3
+    max_range = 400.  # Ultrasonic range
+    echo_loss = 0.  # Chance that a ping gets no echo, reading as zero or as a huge distance
+    ir_range = 10.
+    fov = math.radians(54)  # Camera field of view
+    step_limit = 0.01  # Longest integration step
+
+    def __init__(self, line=(), obstacles=(), x=0., y=0., heading=0., width=300., height=200.):
+        self.segments = [(p[0], p[1], q[0], q[1]) for path in line for p, q in zip(path, path[1:])]
+        self.obstacles = list(obstacles)
+        self.x, self.y, self.heading = x, y, heading
+        self.width, self.height = width, height
+        self.pwm = [0, 0]  # Left, right duty cycle
+        self.reverse = [False, False]
+        self.collisions = 0
+        self.colliding = False
+        self.distance = 0.  # Total distance driven
+        self.time = 0.
+
+    # A stadium-shaped loop of tape with the robot on it, a plain obstacle inside the loop and a green and a red
+    # goal outside it
+    @classmethod
+    def default(cls):
+        line = [(70, 50), (230, 50)]
+        line += [(230 + 50 * math.sin(a * math.pi / 12), 100 - 50 * math.cos(a * math.pi / 12)) for a in range(1, 12)]
+        line += [(230, 150), (70, 150)]
+        line += [(70 - 50 * math.sin(a * math.pi / 12), 100 + 50 * math.cos(a * math.pi / 12)) for a in range(1, 13)]
+        obstacles = [Obstacle(150, 100, 12), Obstacle(150, 185, 6, color='green'), Obstacle(150, 15, 6, color='red')]
+        return cls(line=[line], obstacles=obstacles, x=100, y=50, heading=0.)
+
+    def set_speed(self, side, dc):
+        self.pwm[side] = dc
+
+    def set_reverse(self, side, reverse):
+        self.reverse[side] = bool(reverse)
+
+    def wheel_speeds(self):
+        return [(-1 if r else 1) * min(dc, 1024) / 1024 * self.max_speed for dc, r in zip(self.pwm, self.reverse)]
+
+    def step(self, dt):
+        while dt > 0:
+            h = min(dt, self.step_limit)
+            dt -= h
+            left, right = self.wheel_speeds()
+            v = (left + right) / 2
+            heading = self.heading + (right - left) / self.wheel_base * h
+            x = self.x + v * h * math.cos((self.heading + heading) / 2)
+            y = self.y + v * h * math.sin((self.heading + heading) / 2)
+            blocked = self.blocked(x, y)
+            if blocked and not self.colliding:
+                self.collisions += 1
+            self.colliding = blocked
+            if not blocked:
+                self.distance += abs(v) * h
+                self.x, self.y = x, y
+            self.heading = heading
+            self.time += h
+
+    def blocked(self, x, y):
+        r = self.robot_radius
+        if not (r <= x <= self.width - r and r <= y <= self.height - r):
+            return True
+        return any(math.hypot(o.x - x, o.y - y) < o.radius + r for o in self.obstacles)
+
+    # Point in world coordinates ahead (forward) and to the left of the robot
+    def to_world(self, forward, left):
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        return self.x + forward * c - left * s, self.y + forward * s + left * c
+
+    def line_distance(self, x, y):
+        best = float('inf')
+        for x1, y1, x2, y2 in self.segments:
+            dx, dy = x2 - x1, y2 - y1
+            t = max(0., min(1., ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)))
+            best = min(best, math.hypot(x1 + t * dx - x, y1 + t * dy - y))
+        return best
+
+    # The six reflectance values, left to right: near 0 over the tape, near 1 on the floor, shading over
+    # the last half centimetre of the tape edge
+    def reflectance(self):
+        values = []
+        for i in range(6):
+            x, y = self.to_world(self.sensor_offset, (2.5 - i) * self.sensor_spacing)
+            d = self.line_distance(x, y) - self.line_width / 2
+            values.append(min(0.95, max(0.05, 0.5 + d)))
+        return values
+
+    # Distance to the nearest obstacle or wall along the ray, capped at max_range, and what was hit
+    def cast(self, angle, x=None, y=None):
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        dx, dy = math.cos(angle), math.sin(angle)
+        best, hit = self.max_range, None
+        for wall in ((-x / dx if dx < 0 else (self.width - x) / dx if dx > 0 else float('inf')),
+                     (-y / dy if dy < 0 else (self.height - y) / dy if dy > 0 else float('inf'))):
+            best = min(best, wall)
+        for o in self.obstacles:
+            d = o.hit(x, y, dx, dy)
+            if d is not None and d < best:
+                best, hit = d, o
+        return best, hit
+
+    def ultrasonic_distance(self):
+        x, y = self.to_world(self.robot_radius, 0)
+        return self.cast(self.heading, x, y)[0]
+
+    # [left, right]: True when something is within ir_range at 45 degrees to that side
+    def ir_proximity(self):
+        return [self.cast(self.heading + side * math.pi / 4)[0] - self.robot_radius < self.ir_range
+                for side in (1, -1)]
+
+    # What the camera sees: a grey floor and walls, with each obstacle drawn as a column in its colour
+    # (or dark grey) whose height shrinks with distance
+    def render(self, width, height):
+        from PIL import Image, ImageDraw
+        from imager2 import Imager
+        image = Image.new('RGB', (width, height), (120, 120, 120))
+        draw = ImageDraw.Draw(image)
+        focal = width / 2 / math.tan(self.fov / 2)
+        for column in range(width):
+            angle = self.heading + math.atan((width / 2 - column - 0.5) / focal)
+            d, hit = self.cast(angle)
+            if hit is not None:
+                half = min(height / 2, hit.height * focal / max(d, 1e-3) / 2)
+                color = Imager._pixel_colors_[hit.color] if hit.color else (60, 60, 60)
+                draw.line([(column, height / 2 - half), (column, height / 2 + half)], fill=color)
+        return image
+
+
+# Simulated drivers.  Each overrides everything that touches the hardware and reads the World instead.
+
+class SimMotors(Motors):
+    def __init__(self, world, clock, blocking=False):
+        self.world = world
+        self.clock = clock
+        super(SimMotors, self).__init__(blocking=blocking)
+
+    def setup(self):
+        self.max = 1024
+        self.high = 500
+        self.normal = 300
+        self.low = 100
+        self.set_left_dir(0)
+        self.set_right_dir(0)
+        self.freq = 400
+        self.dc = 0
+
+    def set_left_speed(self, dc):
+        self.world.set_speed(0, dc)
+
+    def set_right_speed(self, dc):
+        self.world.set_speed(1, dc)
+
+    def set_left_dir(self, is_forward):
+        self.world.set_reverse(0, is_forward)
+
+    def set_right_dir(self, is_forward):
+        self.world.set_reverse(1, is_forward)
+
+    def persist(self, duration):
+        if duration:
+            if self.blocking:
+                self.clock.sleep(duration)
+                self.stop()
+            else:
+                self.stop_timer = self.clock.call_later(duration, self.stop)
+
+    def cancel_stop(self):
+        if self.stop_timer is not None:
+            self.clock.cancel(self.stop_timer)
+            self.stop_timer = None
+
+
+class SimReflectanceSensors(ReflectanceSensors):
+    def __init__(self, world):
+        self.world = world
+        super(SimReflectanceSensors, self).__init__(auto_calibrate=False, min_reading=0, max_reading=1)
+
+    def setup(self):
+        self.max_val = [-1] * 6
+        self.min_val = [-1] * 6
+        self.value = [-1.0] * 6
+        self.updated = False
+
+    def compute_value(self):
+        self.value = self.world.reflectance()
+
+
+class SimUltrasonic(Ultrasonic):
+    def __init__(self, world):
+        self.world = world
+        super(SimUltrasonic, self).__init__()
+
+    def setup(self):
+        pass
+
+    def sensor_get_value(self):
+        if self.world.echo_loss and random.random() < self.world.echo_loss:
+            return random.choice((0., 344 * 0.5 * 100 / 2))  # Nothing, or the 0.5 s timeout
+        return self.world.ultrasonic_distance()
+
+
+class SimIRProximitySensor(IRProximitySensor):
+    def __init__(self, world):
+        self.world = world
+        super(SimIRProximitySensor, self).__init__()
+
+    def setup(self):
+        pass
+
+    def sensor_get_value(self):
+        return self.world.ir_proximity()
+
+
+class SimCamera(Camera):
+    def __init__(self, world, *args, **kwargs):
+        self.world = world
+        super(SimCamera, self).__init__(*args, **kwargs)
+
+    def sensor_get_value(self):
+        self.value = self.world.render(self.img_width, self.img_height)
+
+
+class SimZumoButton(ZumoButton):
+    def __init__(self):
+        pass
+
+    def wait_for_press(self):
+        pass
+
+
+# The modules whose time module, and those whose sleep function, a live Simulation replaces with its clock
+TIME_MODULES = (behaviour, ultrasonic)
+SLEEP_MODULES = (motors, reflectance_sensors)
+
+
+class Simulation:
+    # Ties a World to a VirtualClock and hands out simulated sensobs, motobs and schedulers.  The clock replaces
+    # the time functions of the behaviour and driver modules that cannot be handed one, from construction until
+    # close() (or the end of a with block), so only one Simulation is live at a time.
+    def __init__(self, world=None, clock=None):
+        self.world = world if world is not None else World.default()
+        self.clock = clock if clock is not None else VirtualClock()
+        self.clock.listeners.append(self.world.step)
+        self.drive = None  # The motob of the latest controller()
+        self.replaced = [(m, 'time', m.time) for m in TIME_MODULES] + [(m, 'sleep', m.sleep) for m in SLEEP_MODULES]
+        for module in TIME_MODULES:
+            module.time = self.clock
+        for module in SLEEP_MODULES:
+            module.sleep = self.clock.sleep
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Give the modules their own time functions back
+    def close(self):
+        for module, name, original in reversed(self.replaced):
+            setattr(module, name, original)
+        self.replaced = []
+
+    def line_sensob(self):
+        return LineSensob(sensor=SimReflectanceSensors(self.world))
+
+    def proximity_sensob(self):
+        return ProximitySensob(sensor=SimUltrasonic(self.world))
+
+    # Predicts with the commanded speeds of drive, by default the motob of the controller being built
+    def filtered_proximity_sensob(self, drive=None):
+        return FilteredProximitySensob(motob=drive or self.drive, sensor=SimUltrasonic(self.world),
+                                       clock=self.clock.monotonic)
+
+    def color_sensob(self, color):
+        return ColorSensob(color, sensor=SimCamera(self.world))
+
+    def colors_sensob(self, colors=('red', 'green', 'blue')):
+        return ColorsSensob(colors, sensor=SimCamera(self.world))
+
+    def ir_proximity_sensor(self):
+        return SimIRProximitySensor(self.world)
+
+    def motob(self, blocking=False):
+        return Motob(motors=SimMotors(self.world, self.clock, blocking=blocking), clock=self.clock.monotonic)
+
+    def zumo_button(self):
+        return SimZumoButton()
+
+    def scheduler(self, rate=10, **kwargs):
+        return Scheduler(rate=rate, clock=self.clock.monotonic, sleep=self.clock.sleep, **kwargs)
+
+    # A BBCON with a simulated motob and the behaviours of one of the CONFIGS
+    def controller(self, config='full'):
+        bbcon = BBCON(arbitrator=Arbitrator())
+        self.drive = self.motob()
+        bbcon.add_motob(self.drive)
+        for b in CONFIGS[config](self):
+            bbcon.add_behaviour(b)
+        return bbcon
+
+
+# Sensob and behaviour mixes, each building its behaviours on a Simulation
+
+def line_only(sim):
+    return [LineBehaviour(line=sim.line_sensob(), priority=1), ExploreBehaviour(priority=0.25)]
+
+
+# Line following with continuous PID steering, which holds the line at a higher speed
+def line_pid(sim):
+    line = LineBehaviour(line=sim.line_sensob(), priority=1)
+    line.pid = True
+    line.speed = 0.7
+    return [line, ExploreBehaviour(priority=0.25)]
+
+
+# The goal behaviour's trigger distance is raised so the camera is in use on every tick
+def line_camera(sim):
+    goal = GoalBehaviour(proximity=sim.proximity_sensob(), color=sim.color_sensob('green'), priority=5)
+    goal.trigger = sim.world.max_range + 1
+    return [goal, LineBehaviour(line=sim.line_sensob(), priority=1), ExploreBehaviour(priority=0.25)]
+
+
+def proximity_goal(sim):
+    proximity = sim.proximity_sensob()
+    return [CrashPreventionBehaviour(proximity=proximity, priority=2),
+            GoalBehaviour(proximity=proximity, color=sim.color_sensob('green'), priority=5),
+            ExploreBehaviour(priority=0.25)]
+
+
+def full(sim):
+    proximity = sim.proximity_sensob()
+    return [CrashPreventionBehaviour(proximity=proximity, priority=2),
+            GoalBehaviour(proximity=proximity, color=sim.color_sensob('green'), priority=5),
+            LineBehaviour(line=sim.line_sensob(), priority=1),
+            ExploreBehaviour(priority=0.25)]
+
+
+# A goal behaviour for each of the green and red goals, sharing one camera and one colour analysis per tick
+def two_goals(sim):
+    proximity = sim.proximity_sensob()
+    colors = sim.colors_sensob(('green', 'red'))
+    return [CrashPreventionBehaviour(proximity=proximity, priority=2),
+            GoalBehaviour(proximity=proximity, color=colors.color('green'), priority=5),
+            GoalBehaviour(proximity=proximity, color=colors.color('red'), priority=4),
+            LineBehaviour(line=sim.line_sensob(), priority=1),
+            ExploreBehaviour(priority=0.25)]
+
+
+# full, with the distance predicted between pings
+def filtered(sim):
+    proximity = sim.filtered_proximity_sensob()
+    return [CrashPreventionBehaviour(proximity=proximity, priority=2),
+            GoalBehaviour(proximity=proximity, color=sim.color_sensob('green'), priority=5),
+            LineBehaviour(line=sim.line_sensob(), priority=1),
+            ExploreBehaviour(priority=0.25)]
+
+
+CONFIGS = {'line': line_only, 'line-pid': line_pid, 'line+camera': line_camera, 'proximity+goal': proximity_goal,
+           'full': full, 'two-goals': two_goals, 'filtered': filtered}
+
+
+if __name__ == '__main__':
+    import time
+
+    random.seed(0)
+    with Simulation() as sim:
+        bbcon = sim.controller('full')
+        scheduler = sim.scheduler(rate=10)
+        start = time.perf_counter()
+        scheduler.run(bbcon, max_ticks=2000)
+        elapsed = time.perf_counter() - start
+    print("{} ticks ({:.0f} s simulated) in {:.2f} s: {:.0f} ticks/s, {:.0f} cm driven, {} collisions".format(
+        scheduler.ticks, sim.clock.now, elapsed, scheduler.ticks / elapsed, sim.world.distance,
+        sim.world.collisions))
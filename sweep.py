@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Parameter sweeps: run many independently built controllers with different behaviour settings, headless and in
+# parallel, against the simulation or a recording, and collect how each did.
+#
+# Parameters are named behaviour.attribute, e.g. line.speed, goal.trigger or crash.priority, and are set on every
+# behaviour of that type after the controller is built.  Each finished run is appended to the results file as a
+# line of JSON, so an interrupted sweep picks up where it stopped when it is run again with the same arguments.
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+from multiprocessing import Pool
+
+from simulation import CONFIGS, Simulation  # First, so the drivers import off the robot
+from behaviour import CrashPreventionBehaviour, ExploreBehaviour, GoalBehaviour, LineBehaviour
+from recorder import Replay
+
+BEHAVIOURS = {
+    'crash': CrashPreventionBehaviour,
+    'goal': GoalBehaviour,
+    'line': LineBehaviour,
+    'explore': ExploreBehaviour,
+}
+
+
+# {behaviour type: {attribute: value}} from {'behaviour.attribute': value}
+def _by_behaviour(params):
+    grouped = {}
+    for name, value in params.items():
+        kind, attribute = name.split('.', 1)
+        grouped.setdefault(BEHAVIOURS[kind], {})[attribute] = value
+    return grouped
+
+
+def apply(behaviours, params):
+    grouped = _by_behaviour(params)
+    for b in behaviours:
+        for attribute, value in grouped.get(type(b), {}).items():
+            if not hasattr(b, attribute):
+                raise AttributeError("{} has no {}".format(type(b).__name__, attribute))
+            setattr(b, attribute, value)
+
+
+class LapCounter:
+    # Observes a simulated controller and counts the laps the robot drives around the middle of the track,
+    # by following its angle about the centroid of the line
+    def __init__(self, world):
+        self.world = world
+        points = [p for segment in world.segments for p in ((segment[0], segment[1]), (segment[2], segment[3]))]
+        self.cx = sum(p[0] for p in points) / len(points) if points else world.width / 2
+        self.cy = sum(p[1] for p in points) / len(points) if points else world.height / 2
+        self.angle = self._angle()
+        self.turned = 0.
+        self.laps = 0
+        self.lap_end = None  # Simulated time the last lap was completed
+
+    def _angle(self):
+        return math.atan2(self.world.y - self.cy, self.world.x - self.cx)
+
+    def __call__(self, controller):
+        angle = self._angle()
+        self.turned += (angle - self.angle + math.pi) % (2 * math.pi) - math.pi
+        self.angle = angle
+        if abs(self.turned) >= 2 * math.pi * (self.laps + 1):
+            self.laps += 1
+            self.lap_end = self.world.time
+
+
+# Run one job in the simulation: ticks at rate Hz, or until the goal behaviour halts the robot
+def simulate(config, params, seed, ticks, rate):
+    random.seed(seed)
+    with Simulation() as sim:
+        bbcon = sim.controller(config)
+        apply(bbcon.behaviours, params)
+        laps = LapCounter(sim.world)
+        bbcon.add_observer(laps)
+        halted = sim.scheduler(rate=rate).run(bbcon, max_ticks=ticks)
+    return {
+        'ticks': bbcon.tick,
+        'seconds': sim.world.time,
+        'laps': laps.laps,
+        'lap_time': laps.lap_end / laps.laps if laps.laps else None,
+        'collisions': sim.world.collisions,
+        'distance': sim.world.distance,
+        'goal': halted,
+        'goal_time': sim.world.time if halted else None,
+    }
+
+
+_replays = {}
+
+
+# Run one job against a recording.  Nothing is driven, so the result is how far the decisions follow the
+# recorded ones and whether (and when) the goal was reached.
+def replay(path, params, seed):
+    if path not in _replays:
+        _replays[path] = Replay(path)
+    recording = _replays[path]
+    bbcon = recording.controller()
+    apply(bbcon.behaviours, params)
+    result = recording.run(bbcon, seed=seed)
+    return {
+        'ticks': result['ticks'],
+        'mismatches': result['mismatches'],
+        'goal': bbcon.arbitrator.halt,
+        'goal_time': recording.time(result['ticks'] - 1) if bbcon.arbitrator.halt else None,
+    }
+
+
+def run_job(job):
+    if job['replay']:
+        result = replay(job['replay'], job['params'], job['seed'])
+    else:
+        result = simulate(job['config'], job['params'], job['seed'], job['max_ticks'], job['rate'])
+    return dict(job, **result)
+
+
+# A parameter's values: a comma separated list (1,2,3) or, for random search only, a range (lo:hi) sampled
+# uniformly.  Values are parsed as JSON, so 10 and 0.5 become numbers.
+def parse_values(text):
+    if ':' in text:
+        lo, hi = (json.loads(v) for v in text.split(':', 1))
+        return (lo, hi)
+    return [json.loads(v) for v in text.split(',')]
+
+
+def grid(space):
+    names = sorted(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(space, count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        params = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, tuple):
+                lo, hi = values
+                integer = isinstance(lo, int) and isinstance(hi, int)
+                params[name] = rng.randint(lo, hi) if integer else rng.uniform(lo, hi)
+            else:
+                params[name] = rng.choice(values)
+        yield params
+
+
+JOB_FIELDS = ('config', 'max_ticks', 'rate', 'replay', 'params', 'seed')
+
+
+def job_key(job):
+    return json.dumps([job[field] for field in JOB_FIELDS], sort_keys=True)
+
+
+# The results already in path, by job key
+def load_results(path):
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by an interruption; the job runs again
+                    results[job_key(result)] = result
+    return results
+
+
+# Run the jobs not already in the results file on a pool of workers (one per core by default), appending
+# each result as it comes in.  Returns all the results, old and new.
+def sweep(jobs, path, workers=None):
+    results = load_results(path)
+    todo = [job for job in jobs if job_key(job) not in results]
+    with open(path, 'a') as f, Pool(processes=workers) as pool:
+        for result in pool.imap_unordered(run_job, todo):
+            f.write(json.dumps(result, sort_keys=True) + '\n')
+            f.flush()
+            results[job_key(result)] = result
+    return [results[job_key(job)] for job in jobs]
+
+
+# Goal reached first, then fewest collisions, then fastest laps
+def rank(result):
+    lap_time = result.get('lap_time')
+    return (not result['goal'], result.get('collisions', result.get('mismatches', 0)),
+            lap_time if lap_time is not None else math.inf)
+
+
+def print_results(results, top=None):
+    results = sorted(results, key=rank)[:top]
+    for r in results:
+        params = ' '.join('{}={}'.format(name, r['params'][name]) for name in sorted(r['params']))
+        if r['replay']:
+            print("{:<50} seed {:<3} mismatches {:5d}/{:<5d} goal {}".format(
+                params, r['seed'], r['mismatches'], r['ticks'], 'yes' if r['goal'] else 'no'))
+        else:
+            print("{:<50} seed {:<3} laps {:2d} lap time {:>6} s collisions {:4d} goal {}".format(
+                params, r['seed'], r['laps'], '-' if r['lap_time'] is None else '{:.1f}'.format(r['lap_time']),
+                r['collisions'], '{:.1f} s'.format(r['goal_time']) if r['goal'] else 'no'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep behaviour parameters in the simulation or over a recording")
+    parser.add_argument('results', help="JSON lines file the results are appended to, and resumed from")
+    parser.add_argument('--param', action='append', default=[], metavar='BEHAVIOUR.ATTRIBUTE=VALUES',
+                        help="e.g. line.speed=0.2,0.3,0.4 or, with --random, goal.trigger=10:40")
+    parser.add_argument('--random', type=int, metavar='N', help="Random search of N points instead of the full grid")
+    parser.add_argument('--seeds', type=int, default=1, help="Runs per point, with random seeds 0..N-1")
+    parser.add_argument('--config', choices=sorted(CONFIGS), default='full')
+    parser.add_argument('--ticks', type=int, default=3000)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--replay', metavar='RECORDING', help="Run against a recording instead of the simulation")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    space = {}
+    for param in args.param:
+        name, _, values = param.partition('=')
+        if name.split('.', 1)[0] not in BEHAVIOURS or '.' not in name or not values:
+            parser.error("bad parameter {!r}".format(param))
+        space[name] = parse_values(values)
+    if args.random is not None:
+        points = list(random_search(space, args.random))
+    elif any(isinstance(values, tuple) for values in space.values()):
+        parser.error("ranges need --random")
+    else:
+        points = list(grid(space))
+    jobs = [{'config': args.config, 'max_ticks': args.ticks, 'rate': args.rate,
+             'replay': os.path.abspath(args.replay) if args.replay else None, 'params': params, 'seed': seed}
+            for params in points for seed in range(args.seeds)]
+    results = sweep(jobs, args.results, args.workers)
+    print("{} runs in {}".format(len(results), args.results))
+    print_results(results, args.top)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Live telemetry: a controller observer that sends a compact binary snapshot of every tick over a local UDP or
+# Unix datagram socket, and a reference consumer that decodes the stream to print, save or plot it.
+#
+# A snapshot datagram is MAGIC, the tick header (tick, time, seconds since the previous snapshot, the scheduler's
+# latest tick duration and jitter), the recommendation (command, two values, halt flag), then the values of the
+# polled sensobs and the state of every behaviour, each tagged with an id.  The names behind the ids go in a
+# separate JSON datagram, sent whenever a new sensob or behaviour shows up and every schema_interval ticks, so a
+# consumer started mid-run can decode the stream within a few seconds.
+import argparse
+from collections import deque
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b'ZTL1'
+SCHEMA_MAGIC = b'ZTS1'
+DEFAULT_ADDRESS = ('127.0.0.1', 5005)
+
+TICK = struct.Struct('<Idddd')  # tick, time, period, duration, jitter
+RECOMMENDATION = struct.Struct('<2sddB')  # command, value, second value of a ('v', (left, right)) command, halt
+SENSOB = struct.Struct('<BB')  # id, value count, followed by that many doubles
+BEHAVIOUR = struct.Struct('<BBdd')  # id, active, match degree, weight
+
+
+def _number(v):
+    return math.nan if v is None else float(v)
+
+
+def _optional(v):
+    return None if math.isnan(v) else v
+
+
+# A sensob value as a list of numbers: one for a number, one each for a tuple or list of them, none otherwise
+def _numbers(value):
+    if isinstance(value, (tuple, list)):
+        return [_number(v) for v in value if v is None or isinstance(v, (bool, int, float))]
+    if value is None or isinstance(value, (bool, int, float)):
+        return [_number(value)]
+    return []
+
+
+def _socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    return socket.socket(family, socket.SOCK_DGRAM)
+
+
+# host:port for UDP, anything else for a Unix socket path
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return text
+
+
+class Telemetry:
+    # Observes controller (see BBCON.add_observer) and queues a snapshot on every tick, which a sender thread
+    # passes to a non-blocking socket.  The queue keeps the newest capacity snapshots and drops the oldest, and
+    # snapshots the socket will not take (no consumer, or its buffer is full) are dropped too, so neither a slow
+    # nor a missing consumer holds up the control loop.  With a scheduler, its tick timing is included.  sock,
+    # a connected datagram socket (such as one end of a socketpair), is sent on instead of address.
+    def __init__(self, controller, address=DEFAULT_ADDRESS, scheduler=None, capacity=64, schema_interval=50,
+                 clock=time.monotonic, sock=None):
+        self.controller = controller
+        self.address = address
+        self.scheduler = scheduler
+        self.schema_interval = schema_interval
+        self.clock = clock
+        self.ids = {}  # Sensob or behaviour -> id
+        self.names = {'sensobs': {}, 'behaviours': {}}  # id -> name
+        self.schema = None  # Encoded names, when they need sending
+        self.last_time = None
+        self.queue = deque(maxlen=capacity)
+        self.queue_ready = threading.Condition()
+        self.sent = 0
+        self.dropped = 0
+        self.connected = sock is not None
+        self.socket = sock if sock is not None else _socket(address)
+        self.socket.setblocking(False)
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+        controller.add_observer(self)
+
+    def _id(self, obj, kind):
+        if obj not in self.ids:
+            name = type(obj).__name__
+            if getattr(obj, 'color_name', None):
+                name += ':' + obj.color_name
+            taken = set(self.names[kind].values())
+            unique, n = name, 1
+            while unique in taken:
+                n += 1
+                unique = '{}#{}'.format(name, n)
+            self.ids[obj] = len(self.ids)
+            self.names[kind][self.ids[obj]] = unique
+            self.schema = None
+        return self.ids[obj]
+
+    def __call__(self, controller):
+        now = self.clock()
+        period = now - self.last_time if self.last_time is not None else math.nan
+        self.last_time = now
+        duration = jitter = math.nan
+        if self.scheduler is not None:
+            duration = self.scheduler.durations[-1] if self.scheduler.durations else math.nan
+            jitter = self.scheduler.jitter[-1] if self.scheduler.jitter else math.nan
+        parts = [MAGIC, TICK.pack(controller.tick, now, period, duration, jitter)]
+        recommendation = controller.arbitrator.recommendation
+        command, value = recommendation if recommendation else ('', None)
+        values = list(value) if command == 'v' else [_number(value), math.nan]
+        parts.append(RECOMMENDATION.pack(command.encode(), values[0], values[1], controller.arbitrator.halt))
+        # Only values the tick already derived, so telemetry never reads a sensor itself
+        sensobs = [(self._id(s, 'sensobs'), _numbers(s.value)) for s in controller.sensobs if s.has_value]
+        parts.append(struct.pack('<B', len(sensobs)))
+        for i, numbers in sensobs:
+            parts.append(SENSOB.pack(i, len(numbers)) + struct.pack('<{}d'.format(len(numbers)), *numbers))
+        parts.append(struct.pack('<B', len(controller.behaviours)))
+        for b in controller.behaviours:
+            parts.append(BEHAVIOUR.pack(self._id(b, 'behaviours'), b.active, _number(b.match_degree),
+                                        _number(b.weight)))
+        if self.schema is None or controller.tick % self.schema_interval == 0:
+            self.schema = SCHEMA_MAGIC + json.dumps(self.names).encode()
+            self.put(self.schema)
+        self.put(b''.join(parts))
+
+    # Queue a datagram, dropping the oldest one when the queue is full
+    def put(self, packet):
+        with self.queue_ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(packet)
+            self.queue_ready.notify()
+
+    def _send_loop(self):
+        while True:
+            with self.queue_ready:
+                self.queue_ready.wait_for(lambda: self.queue or self.sender is None)
+                if not self.queue:
+                    return
+                packet = self.queue.popleft()
+            try:
+                if self.connected:
+                    self.socket.send(packet)
+                else:
+                    self.socket.sendto(packet, self.address)
+                self.sent += 1
+            except OSError:
+                with self.queue_ready:  # put() counts its drops from the control thread
+                    self.dropped += 1
+
+    def close(self):
+        self.controller.remove_observer(self)
+        with self.queue_ready:
+            sender, self.sender = self.sender, None
+            self.queue_ready.notify()
+        sender.join()
+        self.socket.close()
+
+
+# A snapshot datagram as a dict, with the sensobs and behaviours by name.  names is the latest decoded schema
+# (ids as strings, as JSON has them); ids not in it yet are named by their number.
+def decode(packet, names=None):
+    names = names or {'sensobs': {}, 'behaviours': {}}
+    if not packet.startswith(MAGIC):
+        raise ValueError("Not a telemetry snapshot")
+    offset = len(MAGIC)
+    tick, now, period, duration, jitter = TICK.unpack_from(packet, offset)
+    offset += TICK.size
+    command, value, right, halt = RECOMMENDATION.unpack_from(packet, offset)
+    offset += RECOMMENDATION.size
+    command = command.rstrip(b'\0').decode()
+    snapshot = {
+        'tick': tick, 'time': now, 'period': _optional(period), 'duration': _optional(duration),
+        'jitter': _optional(jitter), 'halt': bool(halt), 'sensobs': {}, 'behaviours': {},
+        'recommendation': ((command, (value, right)) if command == 'v' else (command, _optional(value)))
+        if command else None,
+    }
+    count = packet[offset]
+    offset += 1
+    for _ in range(count):
+        i, n = SENSOB.unpack_from(packet, offset)
+        offset += SENSOB.size
+        numbers = [_optional(v) for v in struct.unpack_from('<{}d'.format(n), packet, offset)]
+        offset += 8 * n
+        snapshot['sensobs'][names['sensobs'].get(str(i), str(i))] = numbers[0] if n == 1 else tuple(numbers)
+    count = packet[offset]
+    offset += 1
+    for _ in range(count):
+        i, active, match, weight = BEHAVIOUR.unpack_from(packet, offset)
+        offset += BEHAVIOUR.size
+        snapshot['behaviours'][names['behaviours'].get(str(i), str(i))] = {
+            'active': bool(active), 'match_degree': _optional(match), 'weight': _optional(weight)}
+    return snapshot
+
+
+# Decoded snapshots from a socket bound to address, as they arrive
+def receive(address=DEFAULT_ADDRESS):
+    sock = _socket(address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)  # Left behind by an earlier consumer
+    sock.bind(address)
+    names = None
+    try:
+        while True:
+            packet = sock.recv(65536)
+            if packet.startswith(SCHEMA_MAGIC):
+                names = json.loads(packet[len(SCHEMA_MAGIC):].decode())
+            elif packet.startswith(MAGIC):
+                yield decode(packet, names)
+    finally:
+        sock.close()
+
+
+def print_snapshot(snapshot):
+    sensobs = ' '.join('{}={}'.format(name, value) for name, value in snapshot['sensobs'].items())
+    weights = ' '.join('{}={:.2f}'.format(name, b['weight']) for name, b in snapshot['behaviours'].items()
+                       if b['active'] and b['weight'] is not None)
+    print("{:6d} {} | {} | {}".format(snapshot['tick'], snapshot['recommendation'], sensobs, weights))
+
+
+# Plot the numeric sensob values and the behaviour weights of the last window ticks, redrawn as they come in
+def plot(snapshots, window=200):
+    import matplotlib.pyplot as plt  # Only needed for plotting
+    series = {}
+    plt.ion()
+    figure, (top, bottom) = plt.subplots(2, sharex=True)
+    for snapshot in snapshots:
+        values = dict(('{}[{}]'.format(name, i), v) for name, value in snapshot['sensobs'].items()
+                      for i, v in enumerate(value if isinstance(value, tuple) else (value,)))
+        values.update(('weight ' + name, b['weight']) for name, b in snapshot['behaviours'].items())
+        for name, v in values.items():
+            series.setdefault(name, deque(maxlen=window)).append((snapshot['tick'], math.nan if v is None else v))
+        if snapshot['tick'] % 5:
+            continue
+        for axes, weights in ((top, False), (bottom, True)):
+            axes.clear()
+            for name, points in series.items():
+                if name.startswith('weight ') == weights:
+                    axes.plot(*zip(*points), label=name)
+            axes.legend(loc='upper left', fontsize='small')
+        plt.pause(0.001)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Receive a controller's telemetry stream")
+    parser.add_argument('address', nargs='?', default='{}:{}'.format(*DEFAULT_ADDRESS),
+                        help="host:port to listen on for UDP, or a Unix socket path")
+    parser.add_argument('--save', metavar='PATH', help="append the snapshots to this JSON lines file")
+    parser.add_argument('--plot', action='store_true', help="plot the values live (needs matplotlib)")
+    parser.add_argument('--quiet', action='store_true', help="do not print the snapshots")
+    args = parser.parse_args()
+    snapshots = receive(parse_address(args.address))
+    output = open(args.save, 'a') if args.save else None
+
+    def consume():
+        for snapshot in snapshots:
+            if output:
+                output.write(json.dumps(snapshot) + '\n')
+            if not args.quiet:
+                print_snapshot(snapshot)
+            yield snapshot
+    try:
+        if args.plot:
+            plot(consume())
+        else:
+            for _ in consume():
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output:
+            output.close()
@@ -0,0 +1,11 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import RPi.GPIO
+    import wiringpi
+except ImportError:  # Off the robot
+    from fake_hardware import install_fake_hardware
+    install_fake_hardware()
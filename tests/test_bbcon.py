@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from arbitrator import Arbitrator
+from bbcon import BBCON
+from sensob import Sensob
+
+
+# A sensor that takes delay seconds to read, and counts its reads
+class SlowSensor:
+    def __init__(self, delay):
+        self.delay = delay
+        self.value = None
+        self.reads = 0
+
+    def update(self):
+        time.sleep(self.delay)
+        self.reads += 1
+        self.value = self.reads
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class Watcher:
+    def __init__(self, sensob):
+        self.sensobs = [sensob]
+        self.deactivated_sensobs = []
+        self.active = True
+
+
+def controller(concurrent, delay):
+    sensor = SlowSensor(delay)
+    watcher = Watcher(Sensob(sensor))
+    bbcon = BBCON(arbitrator=Arbitrator(), concurrent=concurrent)
+    bbcon.add_behaviour(watcher)
+    return bbcon, watcher, sensor
+
+
+# What a timestep does to the sensobs
+def tick(bbcon):
+    bbcon.update_sensobs()
+    bbcon.invalidate_sensobs()
+
+
+# Turning a sensob off must not wait for a read in progress in its sampler
+def test_deactivate_does_not_wait_for_sampler():
+    bbcon, watcher, sensor = controller(True, 0.3)
+    bbcon.update_sensobs()
+    sensob = watcher.sensobs[0]
+    sensob.sampler.join(0.05)  # Into the next read
+    watcher.deactivated_sensobs.append(watcher.sensobs.pop())
+    start = time.perf_counter()
+    bbcon.deactivate(watcher)
+    assert time.perf_counter() - start < 0.05
+    assert sensob.sampler is None
+    sensob.stopped.join()
+    assert sensob.sample is None  # The read that was in progress is discarded
+
+
+# A sensob turned back on is read afresh, not left with the reading from before it was turned off
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_reactivated_sensob_reads_again(concurrent):
+    bbcon, watcher, sensor = controller(concurrent, 0.01)
+    tick(bbcon)
+    sensob = watcher.sensobs[0]
+    before = sensob.get_value()
+    watcher.deactivated_sensobs.append(watcher.sensobs.pop())
+    bbcon.deactivate(watcher)
+    for _ in range(5):
+        tick(bbcon)
+    watcher.sensobs.append(watcher.deactivated_sensobs.pop())
+    bbcon.activate(watcher)
+    assert sensob.get_value() > before
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+import pytest
+
+from camera import Camera
+
+FAKE_CAMERA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fake_camera.py')
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+
+def fake_camera(format, width=40, height=30):
+    command = [sys.executable, FAKE_CAMERA, '-w', str(width), '-h', str(height), '-fps', '60']
+    if format == 'rgb':
+        command.append('-rgb')
+    return Camera(img_width=width, img_height=height, stream=True, command=command, format=format)
+
+
+def nearest_color(rgb):
+    return min(COLORS, key=lambda c: sum(abs(a - int(b)) for a, b in zip(c, rgb)))
+
+
+# The colour of the top left pixel of a frame in either format
+def color_of(frame):
+    return nearest_color(frame.getpixel((0, 0)) if hasattr(frame, 'getpixel') else frame[0, 0])
+
+
+def test_jpeg_stream():
+    camera = fake_camera('jpeg')
+    try:
+        frame = camera.update()
+        assert frame.size == (40, 30)
+        assert frame.mode == 'RGB'
+        pixel = frame.getpixel((20, 15))
+        assert sum(abs(a - b) for a, b in zip(pixel, nearest_color(pixel))) < 30  # JPEG is lossy
+    finally:
+        camera.stop()
+
+
+def test_rgb_stream():
+    camera = fake_camera('rgb')
+    try:
+        frame = camera.update()
+        assert frame.shape == (30, 40, 3)
+        assert tuple(frame[0, 0]) in COLORS
+        assert (frame == frame[0, 0]).all()  # Padding stripped, and a whole frame from one buffer
+    finally:
+        camera.stop()
+
+
+# The fake camera cycles through the colours, so a stream that keeps up shows them all
+@pytest.mark.parametrize('format', ['jpeg', 'rgb'])
+def test_stream_keeps_up(format):
+    camera = fake_camera(format)
+    try:
+        seen = set()
+        for _ in range(100):
+            seen.add(color_of(camera.latest_frame()))
+            if len(seen) == len(COLORS):
+                break
+            time.sleep(0.01)
+        assert len(seen) == len(COLORS)
+    finally:
+        camera.stop()
+    assert camera.process is None
+
+
+def test_bad_format():
+    with pytest.raises(ValueError):
+        fake_camera('png').latest_frame()
@@ -0,0 +1,57 @@
+import pytest
+
+from instrumentation import Instrumentation
+from simulation import Simulation
+
+
+def instrumented_run(instrumentation, ticks=50):
+    with Simulation() as sim:
+        bbcon = sim.controller('line')
+        bbcon.instrument(instrumentation)
+        for _ in range(ticks):
+            bbcon.run_one_timestep()
+        bbcon.instrument(None)
+    return bbcon
+
+
+def test_dump_and_load(tmp_path):
+    instrumentation = Instrumentation()
+    instrumented_run(instrumentation)
+    path = str(tmp_path / 'timings.bin')
+    instrumentation.dump(path)
+    records = list(instrumentation.records())
+    assert Instrumentation.load(path) == records
+    assert {tick for tick, _, _, _ in records} == set(range(1, 51))
+    assert {'BBCON.run_one_timestep', 'Arbitrator.choose_action'} <= {name for _, name, _, _ in records}
+
+
+# Only the newest capacity records are kept and dumped
+def test_ring_buffer(tmp_path):
+    instrumentation = Instrumentation(capacity=20)
+    instrumented_run(instrumentation)
+    path = str(tmp_path / 'timings.bin')
+    instrumentation.dump(path)
+    records = Instrumentation.load(path)
+    assert len(records) == 20
+    assert records == list(instrumentation.records())
+    assert records[-1][0] == 50
+
+
+def test_detach():
+    instrumentation = Instrumentation()
+    with Simulation() as sim:
+        bbcon = sim.controller('line')
+        bbcon.instrument(instrumentation)
+        bbcon.run_one_timestep()
+        count = instrumentation.count
+        bbcon.instrument(None)
+        bbcon.run_one_timestep()
+    assert count and instrumentation.count == count
+    assert 'run_one_timestep' not in vars(bbcon)
+
+
+def test_not_a_dump(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not a dump')
+    with pytest.raises(ValueError):
+        Instrumentation.load(str(path))
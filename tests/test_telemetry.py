@@ -0,0 +1,96 @@
+import json
+import socket
+
+import pytest
+
+import telemetry
+from simulation import Simulation
+from telemetry import Telemetry
+
+
+# The datagrams a simulated controller's telemetry sends to the other end of a socketpair, and the controller
+def stream(config='full', ticks=20):
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.settimeout(1)
+    packets = []
+    with Simulation() as sim:
+        bbcon = sim.controller(config)
+        scheduler = sim.scheduler()
+        sink = Telemetry(bbcon, scheduler=scheduler, clock=sim.clock.monotonic, sock=sender)
+        for _ in range(ticks):
+            scheduler.step(bbcon)
+            packets.append(receiver.recv(65536))
+            while not packets[-1].startswith(telemetry.MAGIC):  # The schema comes first when it is sent
+                packets.append(receiver.recv(65536))
+        sink.close()
+    receiver.close()
+    return packets, bbcon
+
+
+# The snapshots among packets, decoded with the latest schema before each, as telemetry.receive does
+def decode_all(packets):
+    names = None
+    snapshots = []
+    for packet in packets:
+        if packet.startswith(telemetry.SCHEMA_MAGIC):
+            names = json.loads(packet[len(telemetry.SCHEMA_MAGIC):].decode())
+        else:
+            snapshots.append(telemetry.decode(packet, names))
+    return snapshots
+
+
+def test_snapshots_decode():
+    packets, bbcon = stream()
+    assert packets[0].startswith(telemetry.SCHEMA_MAGIC)
+    snapshots = decode_all(packets)
+    assert [s['tick'] for s in snapshots] == list(range(1, 21))
+    assert snapshots[0]['period'] is None
+    last = snapshots[-1]
+    assert last['period'] == pytest.approx(0.1)
+    assert set(last['behaviours']) == {type(b).__name__ for b in bbcon.behaviours}
+    for b in bbcon.behaviours:
+        decoded = last['behaviours'][type(b).__name__]
+        assert decoded['active'] == b.active
+        assert decoded['weight'] == pytest.approx(b.weight)
+    assert last['recommendation'] == bbcon.arbitrator.recommendation
+    assert last['halt'] == bbcon.arbitrator.halt
+    line = next(s for s in bbcon.sensobs if type(s).__name__ == 'LineSensob')
+    assert last['sensobs']['LineSensob'] == tuple(line.value)
+
+
+def test_wheel_speeds():
+    packets, bbcon = stream('line-pid')
+    command, (left, right) = decode_all(packets)[-1]['recommendation']
+    assert command == 'v'
+    assert (left, right) == pytest.approx(bbcon.arbitrator.recommendation[1])
+
+
+# A consumer that has not seen the schema yet still decodes the snapshots, with ids for names
+def test_decode_without_schema():
+    packets, bbcon = stream(ticks=1)
+    snapshot = telemetry.decode(packets[-1])
+    assert len(snapshot['behaviours']) == len(bbcon.behaviours)
+    assert all(name.isdigit() for name in snapshot['behaviours'])
+
+
+def test_not_a_snapshot():
+    with pytest.raises(ValueError):
+        telemetry.decode(b'something else')
+
+
+def test_parse_address():
+    assert telemetry.parse_address('localhost:5005') == ('localhost', 5005)
+    assert telemetry.parse_address('/tmp/telemetry.sock') == '/tmp/telemetry.sock'
+
+
+# Every datagram is either sent or counted as dropped, whether the queue or the socket refused it
+def test_drops_counted_without_consumer(tmp_path):
+    with Simulation() as sim:
+        bbcon = sim.controller('line')
+        scheduler = sim.scheduler()
+        sink = Telemetry(bbcon, str(tmp_path / 'nobody'), scheduler=scheduler, capacity=4, schema_interval=10)
+        for _ in range(50):
+            scheduler.step(bbcon)
+        sink.close()
+    assert sink.sent == 0
+    assert sink.dropped == 50 + 6  # The snapshots, and the schema on the first tick and every 10th
@@ -1,12 +1,32 @@
 import RPi.GPIO as GPIO
+from collections import deque
+import logging
+import threading
 import time
 
+log = logging.getLogger(__name__)
+
 class Ultrasonic():
 
-    def __init__(self):
+    # With interrupts=True a background thread sends a ping every ping_interval seconds (60 ms is the measuring
+    # cycle the HC-SR04 needs), and an edge callback on the echo pin times the echoes into readings, a buffer
+    # of (time, distance) pairs.  update() then takes the newest reading without waiting for the sensor, or
+    # None once three pings in a row went unanswered.  Where the echo pin cannot take an edge callback, update()
+    # falls back to polling.
+    def __init__(self, interrupts=False, ping_interval=0.06, buffer_size=16):
         self.value = None
         self.trig_pin = 26
         self.echo_pin = 11
+        self.interrupts = interrupts
+        self.ping_interval = ping_interval
+        self.max_echo = 0.04  # The echo pin drops after about 38 ms when nothing reflects the ping
+        self.readings = deque(maxlen=buffer_size)
+        self.reading_ready = threading.Condition()
+        self.echo_done = threading.Event()
+        self.edge_lock = threading.Lock()  # Guards expect_rise and rise_ns, shared by the ping thread and callback
+        self.expect_rise = False
+        self.rise_ns = None
+        self.pinger = None
         self.setup()
 
     def setup(self):
@@ -15,7 +35,10 @@ class Ultrasonic():
     def get_value(self):  return self.value
 
     def update(self):
-        self.value = self.sensor_get_value()
+        if self.interrupts and self.start():
+            self.value = self.latest_reading()
+        else:
+            self.value = self.sensor_get_value()
 
     def reset(self):
         self.value = None
@@ -55,6 +78,72 @@ class Ultrasonic():
         # Returnerer distanset til objektet forran sensoren i cm
         return distance
 
+    # Start pinging and listening for echoes, if not already doing so.  Whether the echoes are being timed: if
+    # the edge callback cannot be added, interrupts is switched off and update() polls instead.
+    def start(self):
+        if self.pinger is None and self.interrupts:
+            GPIO.setup(self.trig_pin, GPIO.OUT)
+            GPIO.setup(self.echo_pin, GPIO.IN)
+            GPIO.output(self.trig_pin, GPIO.LOW)
+            try:
+                GPIO.add_event_detect(self.echo_pin, GPIO.BOTH, callback=self._on_echo_edge)
+            except RuntimeError as e:
+                log.warning("No edge detection on the echo pin, polling the ultrasonic sensor instead: %s", e)
+                self.interrupts = False
+                return False
+            self.pinger = threading.Thread(target=self._ping_loop, daemon=True)
+            self.pinger.start()
+        return self.interrupts
+
+    def stop(self):
+        pinger, self.pinger = self.pinger, None
+        if pinger is not None:
+            pinger.join()
+            GPIO.remove_event_detect(self.echo_pin)
+
+    # Waits only until the first echo after start().  None when there is no echo within timeout, or the newest
+    # reading is stale, older than three ping intervals and the longest echo.
+    def latest_reading(self, timeout=1):
+        self.start()
+        with self.reading_ready:
+            if not self.reading_ready.wait_for(lambda: self.readings, timeout):
+                return None
+            t, distance = self.readings[-1]
+        if time.monotonic() - t > 3 * self.ping_interval + self.max_echo:
+            return None
+        return distance
+
+    # The edge direction comes from the ping cycle, not from reading the pin: by the time the callback runs the
+    # pin may already have dropped again after a short echo.  Each ping expects a rise, then a fall.
+    def _on_echo_edge(self, channel):
+        now = time.monotonic_ns()
+        with self.edge_lock:
+            if self.expect_rise:
+                self.expect_rise = False
+                self.rise_ns = now
+                return
+            rise_ns, self.rise_ns = self.rise_ns, None
+        if rise_ns is not None:
+            distance = self.compute_distance(now / 1e9, rise_ns / 1e9)
+            with self.reading_ready:
+                self.readings.append((now / 1e9, distance))
+                self.reading_ready.notify_all()
+            self.echo_done.set()
+
+    def _ping_loop(self):
+        thread = threading.current_thread()
+        while self.pinger is thread:
+            start = time.monotonic()
+            self.echo_done.clear()
+            with self.edge_lock:
+                self.expect_rise = True
+                self.rise_ns = None
+            GPIO.output(self.trig_pin, True)
+            time.sleep(0.00001)
+            GPIO.output(self.trig_pin, False)
+            self.echo_done.wait(self.max_echo)
+            time.sleep(max(0., self.ping_interval - (time.monotonic() - start)))
+
     def send_activation_pulse(self):
         GPIO.output(self.trig_pin, GPIO.LOW)
         # Sensoren kan krasje dersom man ikke har et delay her. Dersom den fortsatt krasjer, prov aa oke delayet
@@ -1,6 +1,9 @@
 __author__ = 'keithd'
+import logging
 import wiringpi as wp
 
+log = logging.getLogger(__name__)
+
 class ZumoButton():
 
     def __init__(self):
@@ -12,5 +15,5 @@ class ZumoButton():
         read_val = wp.digitalRead(22)
         while read_val:
             read_val = wp.digitalRead(22)
-        print("Button pressed!!")
+        log.info("Button pressed!!")
 